@@ -1,10 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import zipfile
 import re
 from datetime import datetime, timedelta
 import plotly.graph_objects as go
-from bisect import bisect_left
 
 st.set_page_config(layout="wide")
 st.title("Bead Signal Viewer with Machine Status Overlay (Dual Y-Axis, Compressed Time)")
@@ -12,32 +12,31 @@ st.title("Bead Signal Viewer with Machine Status Overlay (Dual Y-Axis, Compresse
 with st.sidebar:
     uploaded_zip = st.file_uploader("Upload ZIP of bead signal CSVs", type="zip")
     status_csv = st.file_uploader("Upload machine status CSV", type="csv")
-
-
-# Map each status timestamp to closest original_time in ZIP (within tolerance)
-def map_status_to_adjusted_time(df_status, adjusted_time_map, tolerance_seconds=1):
-    zip_times = sorted(adjusted_time_map.keys())
-    matched_adjusted = []
-
-    for ts in df_status["Timestamp"]:
-        pos = bisect_left(zip_times, ts)
-        nearest = None
-
-        if pos == 0:
-            nearest = zip_times[0]
-        elif pos == len(zip_times):
-            nearest = zip_times[-1]
-        else:
-            before = zip_times[pos - 1]
-            after = zip_times[pos]
-            nearest = before if abs(ts - before) <= abs(ts - after) else after
-
-        if abs(ts - nearest) <= timedelta(seconds=tolerance_seconds):
-            matched_adjusted.append(adjusted_time_map[nearest])
-        else:
-            matched_adjusted.append(None)
-
-    df_status["adjusted_time"] = matched_adjusted
+    align_direction = st.selectbox("Status alignment", ["nearest", "backward", "forward"], index=0)
+    align_tolerance = st.number_input("Alignment tolerance (s)", min_value=0.0, value=1.0, step=0.5)
+
+
+# Map each status timestamp to an original_time in ZIP (within tolerance).
+# direction: "nearest", "backward" (last capture at or before) or "forward" (first capture at or after)
+def map_status_to_adjusted_time(df_status, adjusted_time_map, tolerance_seconds=1, direction="nearest"):
+    zip_times = pd.DataFrame({
+        "original_time": pd.to_datetime(list(adjusted_time_map.keys())),
+        "adjusted_time": pd.to_datetime(list(adjusted_time_map.values())),
+    }).sort_values("original_time")
+
+    # merge_asof needs a sorted left key; remember the original row order to restore it afterwards
+    status_sorted = df_status.assign(_row=np.arange(len(df_status))).sort_values("Timestamp", kind="stable")
+    matched = pd.merge_asof(
+        status_sorted,
+        zip_times,
+        left_on="Timestamp",
+        right_on="original_time",
+        direction=direction,
+        tolerance=pd.Timedelta(seconds=tolerance_seconds),
+    )
+
+    matched = matched.sort_values("_row")
+    df_status["adjusted_time"] = matched["adjusted_time"].to_numpy()
     return df_status.dropna(subset=["adjusted_time"])
 
 
@@ -111,13 +110,15 @@ def process_zip(zip_file):
     return plots_data, adjusted_time_map
 
 
-def process_status_csv(status_file, adjusted_time_map):
+def process_status_csv(status_file, adjusted_time_map, tolerance_seconds=1, direction="nearest"):
     df_status = pd.read_csv(status_file)
     if not {"Timestamp", "Stat1", "Stat2", "Value"}.issubset(df_status.columns):
         return None, []
 
     df_status["Timestamp"] = pd.to_datetime(df_status["Timestamp"])
-    df_status = map_status_to_adjusted_time(df_status, adjusted_time_map, tolerance_seconds=1)
+    df_status = map_status_to_adjusted_time(
+        df_status, adjusted_time_map, tolerance_seconds=tolerance_seconds, direction=direction
+    )
     if df_status.empty:
         return None, []
 
@@ -138,7 +139,9 @@ if uploaded_zip:
 
         if status_csv:
             with st.spinner("Processing machine status CSV..."):
-                df_status, stat1_options = process_status_csv(status_csv, adjusted_time_map)
+                df_status, stat1_options = process_status_csv(
+                    status_csv, adjusted_time_map, tolerance_seconds=align_tolerance, direction=align_direction
+                )
 
                 if df_status is None or df_status.empty:
                     st.warning("No valid or aligned machine status data found.")
@@ -19,7 +19,8 @@ show_bar = st.sidebar.checkbox("Show status as bar plot (instead of line)", valu
 @st.cache_data
 def process_zip(zip_file):
     plots_data = []
-    all_times = []
+    # Running min/max of capture times instead of one list entry per bead
+    time_min = time_max = None
 
     with zipfile.ZipFile(zip_file) as z:
         for csv_filename in sorted(z.namelist()):
@@ -46,6 +47,9 @@ def process_zip(zip_file):
                 except:
                     continue
 
+                time_min = timestamp if time_min is None else min(time_min, timestamp)
+                time_max = timestamp if time_max is None else max(time_max, timestamp)
+
                 for i in range(1, len(row)):
                     plot_rows.append({
                         "original_time": timestamp,
@@ -55,7 +59,6 @@ def process_zip(zip_file):
                         "csv_name": csv_name,
                         "source_file": csv_filename
                     })
-                    all_times.append(timestamp)
 
             if plot_rows:
                 df_plot = pd.DataFrame(plot_rows)
@@ -84,7 +87,7 @@ def process_zip(zip_file):
                 df_plot["adjusted_time"] = compressed_times
                 plots_data.append((csv_filename, df_plot))
 
-    return plots_data, all_times
+    return plots_data, (time_min, time_max)
 
 # --- Load and Process Status CSV ---
 def process_status_csv(status_file):
@@ -95,14 +98,13 @@ def process_status_csv(status_file):
 # --- Main Execution ---
 if uploaded_zip:
     with st.spinner("Processing bead signal ZIP file..."):
-        plots_data, all_bead_times = process_zip(uploaded_zip)
+        plots_data, zip_time_range = process_zip(uploaded_zip)
 
     if not plots_data:
         st.warning("No valid CSV data found in ZIP.")
     else:
         # Define the x-axis range based on ZIP times only
-        min_time = min(all_bead_times)
-        max_time = max(all_bead_times)
+        min_time, max_time = zip_time_range
 
         if status_csv:
             df_status = process_status_csv(status_csv)
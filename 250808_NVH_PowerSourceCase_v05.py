@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
+from pandas.api.types import union_categoricals
+import os
 import zipfile
-import re
-from datetime import datetime, timedelta
+import zlib
+import hashlib
+from pathlib import Path
+from datetime import timedelta
+import numpy as np
 import plotly.graph_objects as go
 
 st.set_page_config(layout="wide")
@@ -14,178 +19,1227 @@ uploaded_zip = st.sidebar.file_uploader("Upload ZIP of Bead Signal CSVs", type="
 status_csv = st.sidebar.file_uploader("Upload Machine Status CSV", type="csv")
 
 status_plot_type = st.sidebar.radio("Status Plot Type", ["Line", "Scatter", "Step"], index=0)
+incremental_ingest = st.sidebar.checkbox(
+    "Incremental ingestion (reuse files parsed from earlier uploads)", value=True
+)
 
 # --- Helper Function ---
+CAPTURE_PATTERN = r"(?P<time>\d{6})_(?P<bm>[A-Z0-9]+)_.*?_(?P<f>F\d+)(?:_(?P<stat>[^.]+))?\.csv"
+BM_DATE_PATTERN = r"(\d{6})Y\d{4}"
+
+
+def parse_capture_names(csv_names):
+    # Vectorized version of the per-row regex + strptime: all regex groups are kept,
+    # "time" becomes the capture timestamp (NaT for unparseable names)
+    parts = csv_names.str.extract(CAPTURE_PATTERN)
+    yymmdd = parts["bm"].str.extract(BM_DATE_PATTERN)[0].fillna("000000")
+    parts["time"] = pd.to_datetime(yymmdd + parts["time"], format="%y%m%d%H%M%S", errors="coerce")
+    parts["stat"] = parts["stat"].fillna("")
+    return parts
+
+
+def compress_date_gaps(times, dates):
+    # Remove the idle gap between the last capture of a day and the first capture of the next
+    new_day = np.r_[False, dates[1:] != dates[:-1]]
+    gaps = np.zeros(len(times), dtype="timedelta64[ns]")
+    gaps[new_day] = times[1:][new_day[1:]] - times[:-1][new_day[1:]]
+    return times - np.cumsum(gaps)
+
+
+def expand_capture_rows(df, csv_filename):
+    # One row per (capture, bead) with categorical labels instead of repeated strings
+    csv_names = df[0].astype(str)
+    parts = parse_capture_names(csv_names)
+    valid = parts["time"].notna().to_numpy()
+    if not valid.any():
+        return None
+
+    parts = parts[valid]
+    times = parts["time"].to_numpy(dtype="datetime64[ns]")
+    signals = df.iloc[valid, 1:].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float32)
+    n_captures, n_beads = signals.shape
+    if n_beads == 0:
+        return None
+
+    name_codes, name_categories = pd.factorize(csv_names[valid])
+    bead_categories = [f"Bead {i:02d}" for i in range(1, n_beads + 1)]
+
+    original_time = np.repeat(times, n_beads)
+    df_rows = pd.DataFrame({
+        "original_time": original_time,
+        "signal": signals.ravel(),
+        "bead_number": pd.Categorical.from_codes(np.tile(np.arange(n_beads), n_captures), bead_categories),
+        "csv_name": pd.Categorical.from_codes(np.repeat(name_codes, n_beads), name_categories),
+        "source_file": pd.Categorical.from_codes(np.zeros(len(original_time), dtype=np.int8), [csv_filename]),
+    })
+    # Remaining regex groups, kept as categorical columns for filtering and aggregation
+    for col, group in [("bm_code", "bm"), ("f_code", "f"), ("stat_suffix", "stat")]:
+        codes, categories = pd.factorize(parts[group])
+        df_rows[col] = pd.Categorical.from_codes(np.repeat(codes, n_beads), categories)
+    return df_rows.sort_values("original_time", kind="stable").reset_index(drop=True)
+
+
+def union_category_frames(frames):
+    # Concatenate long frames whose categorical columns have different category tables
+    if len(frames) == 1:
+        return frames[0]
+    for col in frames[0].select_dtypes("category").columns:
+        categories = union_categoricals([frame[col].array for frame in frames]).categories
+        for frame in frames:
+            frame[col] = pd.Categorical(frame[col], categories=categories)
+    return pd.concat(frames, ignore_index=True)
+
+
+def append_capture_tail(df_plot, df_new):
+    # Continue the gap compression from the last stored capture; None if the tail is not strictly newer
+    last_time = df_plot["original_time"].to_numpy()[-1]
+    last_adjusted = df_plot["adjusted_time"].to_numpy()[-1]
+    if df_new["original_time"].to_numpy()[0] < last_time:
+        return None
+
+    times = np.r_[last_time, df_new["original_time"].to_numpy()]
+    compressed = compress_date_gaps(times, times.astype("datetime64[D]"))
+    df_new["adjusted_time"] = compressed[1:] - (last_time - last_adjusted)
+    return union_category_frames([df_plot, df_new])
+
+
+# --- Streaming ingestion with on-disk spill ---
+# Members are parsed chunk by chunk, reduced to the compact long frame, spilled to disk and released.
+# The viewer only keeps small member handles (plain dicts, so they pickle from a Streamlit script)
+# and loads frames with load_member(handle["path"]) for the files it is drawing.
+NVH_CACHE_DIR = Path(".nvh_cache")
+ZIP_STORE_DIR = NVH_CACHE_DIR / "zip_store"
+SPILL_DIR = NVH_CACHE_DIR / "spill"
+# Sizes the read_csv chunks only; each member is still sorted, pyramided and spilled as a whole
+DEFAULT_CHUNK_BUDGET_MB = 512
+MEMBER_CACHE_ENTRIES = 16
+SPILL_DIR_MAX_MB = 4096  # least recently used spill files are pruned beyond this, per directory
+
+
+@st.cache_resource(max_entries=MEMBER_CACHE_ENTRIES, show_spinner=False)
+def load_member(path):
+    # Returns (df_plot, pyramid) for one spilled member
+    return pd.read_pickle(path)
+
+
+def member_chunk_rows(n_columns, chunk_budget_mb):
+    # Raw CSV rows per chunk: a parsed row costs ~8 bytes per column plus the name string,
+    # and its expanded compact form ~24 bytes per bead; keep a 4x margin for pandas temporaries
+    bytes_per_row = 8 * n_columns + 200 + 24 * max(n_columns - 1, 1)
+    return max(1_000, int(chunk_budget_mb * 2**20 // (4 * bytes_per_row)))
+
+
+def read_member_rows(stream, csv_filename, chunk_budget_mb):
+    # Chunked read of one member into a time-sorted compact frame (without adjusted_time)
+    first_line = stream.peek(1 << 16).split(b"\n", 1)[0]
+    chunk_rows = member_chunk_rows(first_line.count(b",") + 1, chunk_budget_mb)
+    parts = []
+    with pd.read_csv(stream, header=None, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            part = expand_capture_rows(chunk, csv_filename)
+            if part is not None:
+                parts.append(part)
+    if not parts:
+        return None
+    return union_category_frames(parts).sort_values("original_time", kind="stable").reset_index(drop=True)
+
+
+def summarize_member(name, path, df_plot):
+    times = df_plot["original_time"].to_numpy()
+    adjusted = df_plot["adjusted_time"].to_numpy()
+    signal = df_plot["signal"].to_numpy().astype(np.float64)
+    finite = np.isfinite(signal)
+
+    # Mean signal per capture time, used by the clock offset estimation without reloading the frame
+    starts = np.flatnonzero(np.r_[True, times[1:] != times[:-1]])
+    capture_sums = np.add.reduceat(np.where(finite, signal, 0.0), starts)
+    capture_counts = np.add.reduceat(finite.astype(np.int64), starts)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        capture_means = (capture_sums / capture_counts).astype(np.float32)
+
+    # One row per capture (a contiguous run of one csv_name at one time) with its row range
+    name_codes = df_plot["csv_name"].cat.codes.to_numpy()
+    capture_starts = np.flatnonzero(np.r_[True, (times[1:] != times[:-1]) | (name_codes[1:] != name_codes[:-1])])
+    captures = pd.DataFrame({
+        "capture_time": times[capture_starts],
+        "bm_code": df_plot["bm_code"].to_numpy()[capture_starts].astype(str),
+        "f_code": df_plot["f_code"].to_numpy()[capture_starts].astype(str),
+        "stat_suffix": df_plot["stat_suffix"].to_numpy()[capture_starts].astype(str),
+        "row_start": capture_starts,
+        "row_stop": np.r_[capture_starts[1:], len(df_plot)],
+    })
+
+    return {
+        "name": name,
+        "path": str(path),
+        "n_rows": len(df_plot),
+        "n_beads": len(df_plot["bead_number"].cat.categories),
+        "time_range": (pd.Timestamp(times[0]), pd.Timestamp(times[-1])),
+        "adjusted_range": (pd.Timestamp(adjusted[0]), pd.Timestamp(adjusted[-1])),
+        "signal_stats": {
+            "count": int(finite.sum()),
+            "mean": float(signal[finite].mean()) if finite.any() else np.nan,
+            "std": float(signal[finite].std()) if finite.any() else np.nan,
+            "min": float(signal[finite].min()) if finite.any() else np.nan,
+            "max": float(signal[finite].max()) if finite.any() else np.nan,
+        },
+        "capture_times": times[starts],
+        "capture_means": capture_means,
+        "captures": captures,
+    }
+
+
+def member_key(info):
+    # Members are identified by name, size and CRC, so equal names from different archives coexist
+    return info.filename, info.file_size, info.CRC
+
+
+def spill_member(spill_dir, info, df_plot):
+    # Spill files are content-addressed by member name, size and CRC
+    spill_dir.mkdir(parents=True, exist_ok=True)
+    key = "{}|{}|{:08x}".format(*member_key(info))
+    path = spill_dir / f"{hashlib.sha1(key.encode()).hexdigest()}.pkl"
+    pd.to_pickle((df_plot, build_time_pyramid(df_plot)), path)
+    return summarize_member(info.filename, path, df_plot)
+
+
+def touch_spill_files(handles):
+    # Marks spill files as recently used; pruning goes by modification time
+    for handle in handles:
+        os.utime(handle["path"])
+
+
+def prune_spill_files(spill_dir, keep_paths, max_bytes):
+    # Deletes spill pickles outside keep_paths, least recently used first, until the remaining files
+    # fit in max_bytes. Cached process_zip results may still name a deleted file; load_archive
+    # recomputes those.
+    keep = {Path(path) for path in keep_paths}
+    used = sum(path.stat().st_size for path in keep if path.exists())
+    others = sorted(
+        (path for path in spill_dir.glob("*.pkl") if path not in keep and path.name != "manifest.pkl"),
+        key=lambda path: path.stat().st_mtime, reverse=True,
+    )
+    for path in others:
+        used += path.stat().st_size
+        if used > max_bytes:
+            path.unlink(missing_ok=True)
+
+
+# Bump when the spilled frame or handle layout changes, so older stores are re-parsed
+ZIP_STORE_VERSION = 3
+
+
+def load_zip_store():
+    manifest_path = ZIP_STORE_DIR / "manifest.pkl"
+    if not manifest_path.exists():
+        return {}
+    manifest = pd.read_pickle(manifest_path)
+    return manifest["members"] if manifest.get("version") == ZIP_STORE_VERSION else {}
+
+
+def save_zip_store(store):
+    ZIP_STORE_DIR.mkdir(parents=True, exist_ok=True)
+    pd.to_pickle({"version": ZIP_STORE_VERSION, "members": store}, ZIP_STORE_DIR / "manifest.pkl")
+
+
+def stored_prefix_matches(stream, entry):
+    # Streams the first entry["size"] bytes through crc32, leaving the stream at the appended tail
+    crc = 0
+    remaining = entry["size"]
+    while remaining > 0:
+        block = stream.read(min(remaining, 1 << 20))
+        if not block:
+            return False
+        crc = zlib.crc32(block, crc)
+        remaining -= len(block)
+    return crc == entry["crc"]
+
+
+def stored_prefixes(store, info):
+    # Stored generations of this member that are shorter than it, largest first
+    entries = [
+        entry for (name, size, _), entry in store.items()
+        if name == info.filename and size < info.file_size and Path(entry["handle"]["path"]).exists()
+    ]
+    return sorted(entries, key=lambda entry: entry["size"], reverse=True)
+
+
+def ingest_zip_member(z, info, store, spill_dir, chunk_budget_mb):
+    # Returns (handle, how) where how is "reused", "appended" or "parsed"
+    entry = store.get(member_key(info))
+    if entry is not None and Path(entry["handle"]["path"]).exists():
+        touch_spill_files([entry["handle"]])
+        return entry["handle"], "reused"
+
+    for entry in stored_prefixes(store, info):
+        with z.open(info) as stream:
+            if stored_prefix_matches(stream, entry):
+                # Stored content is an unchanged prefix: only the appended rows are parsed
+                df_new = read_member_rows(stream, info.filename, chunk_budget_mb)
+                stored_plot, _ = load_member(entry["handle"]["path"])
+                df_plot = stored_plot if df_new is None else append_capture_tail(stored_plot.copy(), df_new)
+                if df_plot is not None:
+                    return spill_member(spill_dir, info, df_plot), "appended"
+
+    with z.open(info) as stream:
+        df_plot = read_member_rows(stream, info.filename, chunk_budget_mb)
+    if df_plot is None:
+        return None, "parsed"
+
+    # The calendar day is derived on the fly instead of being stored per row
+    sorted_times = df_plot["original_time"].to_numpy()
+    df_plot["adjusted_time"] = compress_date_gaps(sorted_times, sorted_times.astype("datetime64[D]"))
+    return spill_member(spill_dir, info, df_plot), "parsed"
+
+
 @st.cache_data
-def process_zip(zip_file):
-    plots_data = []
-    all_times = []
+def process_zip(zip_file, incremental=False, chunk_budget_mb=DEFAULT_CHUNK_BUDGET_MB):
+    # Returns member handles, the archive-wide capture time range and ingestion counts
+    handles = []
+    time_min = time_max = None
+    store = load_zip_store() if incremental else {}
+    spill_dir = ZIP_STORE_DIR if incremental else SPILL_DIR
+    ingest_counts = {"reused": 0, "appended": 0, "parsed": 0}
 
     with zipfile.ZipFile(zip_file) as z:
-        for csv_filename in sorted(z.namelist()):
-            if not csv_filename.lower().endswith(".csv"):
+        for info in sorted(z.infolist(), key=lambda i: i.filename):
+            if not info.filename.lower().endswith(".csv"):
                 continue
 
-            with z.open(csv_filename) as f:
-                df = pd.read_csv(f, header=None)
+            handle, how = ingest_zip_member(z, info, store, spill_dir, chunk_budget_mb)
+            ingest_counts[how] += 1
+            if handle is None:
+                continue
+            if incremental:
+                # Earlier generations stay until pruned: cached results of older uploads may use them
+                store[member_key(info)] = {"size": info.file_size, "crc": info.CRC, "handle": handle}
 
-            plot_rows = []
-            for _, row in df.iterrows():
-                csv_name = str(row[0])
-                match = re.search(r"(?P<time>\d{6})_(?P<bm>[A-Z0-9]+)_.*?_(?P<f>F\d+)(?:_(?P<stat>[^.]+))?\.csv", csv_name)
-                if not match:
-                    continue
+            time_min = handle["time_range"][0] if time_min is None else min(time_min, handle["time_range"][0])
+            time_max = handle["time_range"][1] if time_max is None else max(time_max, handle["time_range"][1])
+            handles.append(handle)
 
-                hhmmss = match.group("time")
-                bma_code = match.group("bm")
-                date_match = re.search(r"(\d{6})Y\d{4}", bma_code)
-                yymmdd = date_match.group(1) if date_match else "000000"
+    prune_spill_files(spill_dir, [handle["path"] for handle in handles], SPILL_DIR_MAX_MB * 2**20)
+    if incremental:
+        save_zip_store({key: entry for key, entry in store.items() if Path(entry["handle"]["path"]).exists()})
+    return handles, (time_min, time_max), build_capture_index(handles), ingest_counts
 
-                try:
-                    timestamp = datetime.strptime(yymmdd + hhmmss, "%y%m%d%H%M%S")
-                except:
-                    continue
 
-                for i in range(1, len(row)):
-                    plot_rows.append({
-                        "original_time": timestamp,
-                        "date": timestamp.date(),
-                        "signal": row[i],
-                        "bead_number": f"Bead {i:02d}",
-                        "csv_name": csv_name,
-                        "source_file": csv_filename
-                    })
-                    all_times.append(timestamp)
+def load_archive(zip_file, incremental=False, chunk_budget_mb=DEFAULT_CHUNK_BUDGET_MB):
+    # process_zip for the viewer: a cached result whose spill files were pruned since is recomputed,
+    # and the files of the archive on screen are marked as recently used
+    result = process_zip(zip_file, incremental, chunk_budget_mb)
+    if not all(Path(handle["path"]).exists() for handle in result[0]):
+        process_zip.clear(zip_file, incremental, chunk_budget_mb)
+        result = process_zip(zip_file, incremental, chunk_budget_mb)
+    touch_spill_files(result[0])
+    return result
+
+
+# --- Capture Index (date, BM code, F-code, stat suffix) ---
+def build_capture_index(handles):
+    # One row per capture across the archive, sorted by time; "member" points into handles
+    if not handles:
+        return pd.DataFrame()
+    index = pd.concat(
+        [handle["captures"].assign(member=np.int32(i)) for i, handle in enumerate(handles)],
+        ignore_index=True,
+    )
+    for col in ["bm_code", "f_code", "stat_suffix"]:
+        index[col] = index[col].astype("category")
+    index = index.sort_values("capture_time", kind="stable").reset_index(drop=True)
+    index["date"] = index["capture_time"].dt.normalize()
+    return index
+
+
+def query_captures(capture_index, date_range=None, bm_codes=(), f_codes=(), stat_suffixes=()):
+    # Date range by binary search on the sorted capture times, code filters on the small index only
+    selected = capture_index
+    if date_range is not None:
+        times = capture_index["capture_time"].to_numpy()
+        lo = np.searchsorted(times, np.datetime64(pd.Timestamp(date_range[0]), "ns"))
+        hi = np.searchsorted(times, np.datetime64(pd.Timestamp(date_range[1]) + pd.Timedelta(days=1), "ns"))
+        selected = selected.iloc[lo:hi]
+    for col, values in [("bm_code", bm_codes), ("f_code", f_codes), ("stat_suffix", stat_suffixes)]:
+        if values:
+            selected = selected[selected[col].isin(values)]
+    return selected
+
 
-            if plot_rows:
-                df_plot = pd.DataFrame(plot_rows)
-                df_plot = df_plot.sort_values("original_time").reset_index(drop=True)
+def ranges_to_rows(starts, stops):
+    # Concatenated np.arange(start, stop) for every range, without a Python loop
+    lengths = stops - starts
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    return np.arange(lengths.sum()) + offsets
 
-                # Compress gaps between dates
-                compressed_times = []
-                prev_date = None
-                time_offset = timedelta(0)
-                last_end_time = None
+# Traces above this many points are drawn with WebGL instead of SVG
+WEBGL_POINT_THRESHOLD = 2000
 
-                for _, row in df_plot.iterrows():
-                    current_time = row["original_time"]
-                    current_date = row["date"]
 
-                    if prev_date is not None and current_date != prev_date:
-                        gap = current_time - last_end_time
-                        time_offset += gap
+def build_bead_traces(df_plot):
+    # Group once: a stable sort on the bead codes keeps every bead's rows contiguous and in time order
+    bead_codes = df_plot["bead_number"].cat.codes.to_numpy()
+    order = np.argsort(bead_codes, kind="stable")
+    bead_categories = df_plot["bead_number"].cat.categories
+    offsets = np.searchsorted(bead_codes[order], np.arange(len(bead_categories) + 1))
 
-                    compressed_time = current_time - time_offset
-                    compressed_times.append(compressed_time)
+    x = df_plot["adjusted_time"].to_numpy()[order]
+    y = df_plot["signal"].to_numpy()[order]
+    # Hover labels are resolved from the category tables only for the rows being plotted
+    csv_names = df_plot["csv_name"].cat.categories.to_numpy()[df_plot["csv_name"].cat.codes.to_numpy()[order]]
+    original_times = np.datetime_as_string(df_plot["original_time"].to_numpy()[order], unit="s")
 
-                    prev_date = current_date
-                    last_end_time = current_time
+    traces = []
+    for bead_code, bead in enumerate(bead_categories):
+        start, stop = offsets[bead_code], offsets[bead_code + 1]
+        if start == stop:
+            continue
 
-                df_plot["adjusted_time"] = compressed_times
-                plots_data.append((csv_filename, df_plot))
+        scatter = go.Scattergl if stop - start > WEBGL_POINT_THRESHOLD else go.Scatter
+        traces.append(scatter(
+            x=x[start:stop],
+            y=y[start:stop],
+            mode="lines",
+            name=bead,
+            line=dict(width=1),
+            customdata=np.column_stack([csv_names[start:stop], original_times[start:stop]]),
+            hovertemplate=(
+                f"Bead: {bead}<br>"
+                f"Original Time: %{{customdata[1]|%Y-%m-%d %H:%M:%S}}<br>"
+                f"Signal: %{{y:.2f}}<br>"
+                f"File: %{{customdata[0]}}<extra></extra>"
+            ),
+            yaxis="y1"
+        ))
+    return traces
 
-    return plots_data, all_times
+# --- Time Pyramid (multi-resolution min/max/mean per bead) ---
+# Points per bead trace the viewer aims for at any zoom level
+TRACE_POINT_BUDGET = 2000
+PYRAMID_BASE_WIDTH = pd.Timedelta(seconds=10)
+PYRAMID_FACTOR = 4
+PYRAMID_MIN_BUCKETS = 500
+
+
+def build_time_pyramid(df_plot):
+    # Each level buckets adjusted_time with a width PYRAMID_FACTOR times coarser than the previous one,
+    # until the whole span fits in PYRAMID_MIN_BUCKETS buckets. Rows are sorted by (bead, time).
+    bead_codes = df_plot["bead_number"].cat.codes.to_numpy().astype(np.int64)
+    n_beads = len(df_plot["bead_number"].cat.categories)
+    times = df_plot["adjusted_time"].to_numpy().astype(np.int64)
+    signal = df_plot["signal"].to_numpy()
+    t0 = times.min()
+
+    levels = []
+    width = PYRAMID_BASE_WIDTH.value
+    while True:
+        buckets = (times - t0) // width
+        n_buckets = int(buckets.max()) + 1
+        agg = (
+            pd.Series(signal).groupby(bead_codes * n_buckets + buckets)
+            .agg(["min", "max", "mean", "count"])
+        )
+        keys = agg.index.to_numpy()
+        level = pd.DataFrame({
+            "bead_code": (keys // n_buckets).astype(np.int16),
+            "time": (t0 + (keys % n_buckets) * width + width // 2).astype("datetime64[ns]"),
+            "min": agg["min"].to_numpy(dtype=np.float32),
+            "max": agg["max"].to_numpy(dtype=np.float32),
+            "mean": agg["mean"].to_numpy(dtype=np.float32),
+            "count": agg["count"].to_numpy(dtype=np.int32),
+        })
+        offsets = np.searchsorted(level["bead_code"].to_numpy(), np.arange(n_beads + 1))
+        levels.append({"width": pd.Timedelta(width), "frame": level, "offsets": offsets})
+
+        if n_buckets <= PYRAMID_MIN_BUCKETS:
+            break
+        width *= PYRAMID_FACTOR
+    return levels
+
+
+def select_pyramid_level(df_plot, pyramid, window):
+    # None means the raw rows in the window already fit the budget
+    lo, hi = np.datetime64(window[0], "ns"), np.datetime64(window[1], "ns")
+    adjusted = df_plot["adjusted_time"].to_numpy()
+    start, stop = np.searchsorted(adjusted, lo), np.searchsorted(adjusted, hi, side="right")
+    # Beads actually present in the window (a filtered frame keeps the full category list)
+    codes = df_plot["bead_number"].cat.codes.to_numpy()[start:stop]
+    n_beads = max(np.count_nonzero(np.bincount(codes[codes >= 0])), 1)
+    if (stop - start) / n_beads <= TRACE_POINT_BUDGET:
+        return None
+
+    for level_idx, level in enumerate(pyramid):
+        times = level["frame"]["time"].to_numpy()
+        offsets = level["offsets"]
+        per_bead = [
+            np.searchsorted(times[a:b], hi, side="right") - np.searchsorted(times[a:b], lo)
+            for a, b in zip(offsets[:-1], offsets[1:])
+        ]
+        if max(per_bead, default=0) <= TRACE_POINT_BUDGET:
+            return level_idx
+    return len(pyramid) - 1
+
+
+def build_pyramid_traces(level, bead_categories, window):
+    lo, hi = np.datetime64(window[0], "ns"), np.datetime64(window[1], "ns")
+    frame = level["frame"]
+    times = frame["time"].to_numpy()
+    stats = frame[["mean", "min", "max", "count"]].to_numpy()
+    offsets = level["offsets"]
+
+    traces = []
+    for bead_code, bead in enumerate(bead_categories):
+        a, b = offsets[bead_code], offsets[bead_code + 1]
+        start = a + np.searchsorted(times[a:b], lo)
+        stop = a + np.searchsorted(times[a:b], hi, side="right")
+        if start == stop:
+            continue
+
+        scatter = go.Scattergl if stop - start > WEBGL_POINT_THRESHOLD else go.Scatter
+        traces.append(scatter(
+            x=times[start:stop],
+            y=stats[start:stop, 0],
+            mode="lines",
+            name=bead,
+            line=dict(width=1),
+            customdata=stats[start:stop, 1:],
+            hovertemplate=(
+                f"Bead: {bead}<br>"
+                f"Bucket: %{{x|%Y-%m-%d %H:%M:%S}}<br>"
+                f"Mean: %{{y:.2f}} (min %{{customdata[0]:.2f}}, max %{{customdata[1]:.2f}})<br>"
+                f"Captures: %{{customdata[2]:d}}<extra></extra>"
+            ),
+            yaxis="y1"
+        ))
+    return traces
 
 # --- Load and Process Status CSV ---
-def process_status_csv(status_file):
-    df_status = pd.read_csv(status_file)
-    df_status["Timestamp"] = pd.to_datetime(df_status["Timestamp"]) - pd.to_timedelta("6m28s")
-    return df_status
+STATUS_COLUMNS = ["Timestamp", "Stat1", "Stat2", "Value"]
+# Fallback PLC clock offset, used in manual mode or when the automatic estimate is not confident
+STATUS_TIME_OFFSET = pd.to_timedelta("6m28s")
+STATUS_CHUNK_ROWS = 500_000
+STATUS_INDEX_DIR = NVH_CACHE_DIR / "status_index"
+
+
+@st.cache_data(show_spinner=False)
+def status_file_digest(_status_file, file_id):
+    # Content hash used as the on-disk index key; file_id only keys the in-memory cache
+    digest = hashlib.sha1()
+    _status_file.seek(0)
+    for block in iter(lambda: _status_file.read(1 << 20), b""):
+        digest.update(block)
+    _status_file.seek(0)
+    return digest.hexdigest()
+
+
+def has_status_columns(status_file):
+    status_file.seek(0)
+    header = pd.read_csv(status_file, nrows=0).columns
+    status_file.seek(0)
+    return set(STATUS_COLUMNS).issubset(header)
+
+
+@st.cache_data(show_spinner=False)
+def load_status_wide(_status_file, digest):
+    # Time-indexed table with one float64 column per (Stat1, Stat2) in order of first appearance,
+    # pivoted in one chunked pass and cached on disk by content hash.
+    # Timestamps stay on the PLC clock here; the clock offset is applied by the caller.
+    # Non-numeric values (e.g. RUN/IDLE mode rows) are ignored and counted per series in
+    # attrs["non_numeric"]; series without any numeric value are dropped.
+    wide_path = STATUS_INDEX_DIR / f"{digest}_wide.pkl"
+    if wide_path.exists():
+        return pd.read_pickle(wide_path)
+
+    parts = []
+    non_numeric = []
+    labels = {}
+    _status_file.seek(0)
+    with pd.read_csv(
+        _status_file, usecols=STATUS_COLUMNS, dtype={"Timestamp": str}, chunksize=STATUS_CHUNK_ROWS
+    ) as reader:
+        for chunk in reader:
+            chunk = chunk.dropna(subset=["Stat1", "Stat2"])
+            value = pd.to_numeric(chunk["Value"], errors="coerce")
+            ignored = value.isna() & chunk["Value"].notna()
+            chunk = chunk.assign(
+                Timestamp=pd.to_datetime(chunk["Timestamp"]),
+                label=chunk["Stat1"].astype(str) + "-" + chunk["Stat2"].astype(str),
+                Value=value,
+            )
+            labels.update(dict.fromkeys(chunk["label"].unique()))
+            non_numeric.append(chunk.loc[ignored, "label"].value_counts())
+            parts.append(chunk.groupby(["Timestamp", "label"])["Value"].last().unstack("label"))
+    if not parts:
+        return pd.DataFrame(dtype=np.float64)
+
+    wide = pd.concat(parts).groupby(level=0).last().reindex(columns=list(labels)).astype(np.float64)
+    wide = wide.loc[:, wide.notna().any()]
+    wide.columns.name = None
+    counts = pd.concat(non_numeric).groupby(level=0).sum()
+    wide.attrs["non_numeric"] = {label: int(n) for label, n in counts.items() if n > 0}
+    STATUS_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    pd.to_pickle(wide, wide_path)
+    return wide
+
+# --- Clock Offset Estimation (FFT cross-correlation) ---
+OFFSET_GRID_STEP = pd.Timedelta(seconds=1)
+OFFSET_MAX_FILL = pd.Timedelta(seconds=60)
+OFFSET_MIN_OVERLAP = 30
+OFFSET_MIN_CONFIDENCE = 0.3
+
+
+def resample_to_grid(times, values, grid_start, n_steps, step):
+    # Mean per grid cell; empty cells are interpolated only across short gaps, the rest stay NaN
+    cells = (times - grid_start) // step
+    inside = (cells >= 0) & (cells < n_steps) & ~np.isnan(values)
+    cells, values = cells[inside], values[inside]
+    sums = np.bincount(cells, weights=values, minlength=n_steps)
+    counts = np.bincount(cells, minlength=n_steps)
+
+    filled = np.flatnonzero(counts)
+    grid = np.full(n_steps, np.nan)
+    if len(filled) == 0:
+        return grid
+    grid[filled] = sums[filled] / counts[filled]
+
+    missing = np.flatnonzero(counts == 0)
+    right = np.searchsorted(filled, missing)
+    has_both = (right > 0) & (right < len(filled))
+    short_gap = np.zeros(len(missing), dtype=bool)
+    short_gap[has_both] = (
+        filled[right[has_both]] - filled[right[has_both] - 1]
+    ) * step <= OFFSET_MAX_FILL.value
+    grid[missing[short_gap]] = np.interp(missing[short_gap], filled, grid[filled])
+    return grid
+
+
+def estimate_clock_offset(bead_times, bead_values, status_times, status_values, search_window):
+    # Lag (status clock minus bead clock) that maximises the normalised cross-correlation within
+    # +/- search_window. Returns (offset, confidence) with confidence = |r| at that lag, or None.
+    step = OFFSET_GRID_STEP.value
+    bead_times = bead_times.astype("datetime64[ns]").astype(np.int64)
+    status_times = status_times.astype("datetime64[ns]").astype(np.int64)
+    # Only status samples that can line up with a capture at some lag in the window matter; the
+    # grid and the status normalisation are taken over that stretch, not over the whole log
+    reach = search_window.value + OFFSET_MAX_FILL.value
+    near = (status_times >= bead_times.min() - reach) & (status_times <= bead_times.max() + reach)
+    status_times, status_values = status_times[near], status_values[near]
+    if len(status_times) < OFFSET_MIN_OVERLAP:
+        return None
+    grid_start = min(bead_times.min(), status_times.min())
+    n_steps = int((max(bead_times.max(), status_times.max()) - grid_start) // step) + 1
+
+    bead = resample_to_grid(bead_times, bead_values.astype(float), grid_start, n_steps, step)
+    status = resample_to_grid(status_times, status_values.astype(float), grid_start, n_steps, step)
+    bead_mask = ~np.isnan(bead)
+    status_mask = ~np.isnan(status)
+    if bead_mask.sum() < OFFSET_MIN_OVERLAP or status_mask.sum() < OFFSET_MIN_OVERLAP:
+        return None
+
+    bead = np.where(bead_mask, (bead - np.nanmean(bead)) / (np.nanstd(bead) or 1.0), 0.0)
+    status = np.where(status_mask, (status - np.nanmean(status)) / (np.nanstd(status) or 1.0), 0.0)
+
+    # corr[k] = sum_t status[t + k] * bead[t], normalised by the number of overlapping samples
+    n_fft = 1 << int(2 * n_steps - 1).bit_length()
+
+    def xcorr(a, b):
+        return np.fft.irfft(np.fft.rfft(a, n_fft) * np.conj(np.fft.rfft(b, n_fft)), n_fft)
+
+    max_lag = min(int(search_window.value // step), n_steps - 1)
+    lags = np.arange(-max_lag, max_lag + 1)
+    status_mask, bead_mask = status_mask.astype(float), bead_mask.astype(float)
+    overlap = np.rint(xcorr(status_mask, bead_mask)[lags])
+    # Pearson per lag: means and variances are those of the overlapping samples at that lag
+    n = np.maximum(overlap, 1)
+    s1, s2 = xcorr(status, bead_mask)[lags], xcorr(status ** 2, bead_mask)[lags]
+    b1, b2 = xcorr(status_mask, bead)[lags], xcorr(status_mask, bead ** 2)[lags]
+    cov = xcorr(status, bead)[lags] - s1 * b1 / n
+    var = np.maximum(s2 - s1 ** 2 / n, 0.0) * np.maximum(b2 - b1 ** 2 / n, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.where((overlap >= OFFSET_MIN_OVERLAP) & (var > 0), cov / np.sqrt(var), 0.0)
+    if not np.any(r):
+        return None
+
+    best = int(np.argmax(np.abs(r)))
+    return pd.Timedelta(int(lags[best]) * step), float(min(abs(r[best]), 1.0))
+
+
+@st.cache_data(show_spinner=False)
+def estimate_status_offset(_handles, archive_id, _status_series, status_digest, series_label, search_minutes):
+    # Mean bead signal per capture vs one status series, both on their own clocks
+    bead_times = np.concatenate([handle["capture_times"] for handle in _handles])
+    bead_values = np.concatenate([handle["capture_means"] for handle in _handles])
+    return estimate_clock_offset(
+        bead_times, bead_values,
+        _status_series.index.to_numpy(), _status_series.to_numpy(),
+        pd.Timedelta(minutes=search_minutes),
+    )
+
+# --- Status vs Bead Correlation ---
+STATUS_ALIGN_TOLERANCE = pd.Timedelta(seconds=30)
+CORRELATION_MIN_PAIRS = 10
+
+
+def member_signal_block(df_plot, captures, n_beads):
+    # captures x beads signal matrix of one member, rows in the member's capture order
+    lengths = (captures["row_stop"] - captures["row_start"]).to_numpy()
+    capture_ids = np.repeat(np.arange(len(captures)), lengths)
+    block = np.full((len(captures), n_beads), np.nan, dtype=np.float32)
+    block[capture_ids, df_plot["bead_number"].cat.codes.to_numpy()] = df_plot["signal"].to_numpy()
+    return block
+
+
+def load_capture_matrix(handles):
+    # (capture times, captures x beads signal matrix, bead names) over the whole archive, sorted by
+    # time; members are loaded one at a time
+    max_beads = max(handle["n_beads"] for handle in handles)
+    times, blocks, bead_names = [], [], []
+    for handle in handles:
+        df_plot, _ = load_member(handle["path"])
+        if handle["n_beads"] == max_beads and not bead_names:
+            bead_names = df_plot["bead_number"].cat.categories.tolist()
+        captures = handle["captures"]
+        times.append(captures["capture_time"].to_numpy())
+        blocks.append(member_signal_block(df_plot, captures, max_beads))
+
+    times = np.concatenate(times)
+    order = np.argsort(times, kind="stable")
+    return times[order], np.concatenate(blocks)[order], bead_names
+
+
+def align_status_to_captures(capture_times, status_wide, time_offset, tolerance=STATUS_ALIGN_TOLERANCE):
+    # captures x series matrix: nearest sample of every series within tolerance, NaN otherwise
+    aligned = np.full((len(capture_times), status_wide.shape[1]), np.nan)
+    for j, label in enumerate(status_wide.columns):
+        series = status_wide[label].dropna()
+        if series.empty:
+            continue
+        status_times = (series.index - time_offset).to_numpy()
+        right = np.minimum(np.searchsorted(status_times, capture_times), len(status_times) - 1)
+        left = np.maximum(right - 1, 0)
+        use_left = np.abs(capture_times - status_times[left]) <= np.abs(status_times[right] - capture_times)
+        nearest = np.where(use_left, left, right)
+        within = np.abs(status_times[nearest] - capture_times) <= tolerance.to_timedelta64()
+        aligned[within, j] = series.to_numpy()[nearest[within]]
+    return aligned
+
+
+def pairwise_pearson(x, y):
+    # Pearson r between every column of x and every column of y over pairwise-complete rows,
+    # computed with masked matrix products; returns (r, n) of shape (x cols, y cols).
+    # Columns are centred on their own mean first: the raw-moment formula below cancels badly for
+    # series far from zero (e.g. PLC counters around 2**32)
+    mx, my = ~np.isnan(x), ~np.isnan(y)
+    x0, y0 = np.where(mx, x, 0.0), np.where(my, y, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        x0 = np.where(mx, x0 - x0.sum(axis=0) / mx.sum(axis=0), 0.0)
+        y0 = np.where(my, y0 - y0.sum(axis=0) / my.sum(axis=0), 0.0)
+    mx, my = mx.astype(np.float64), my.astype(np.float64)
+    n = mx.T @ my
+    sx, sy = x0.T @ my, mx.T @ y0
+    sxx, syy = (x0 ** 2).T @ my, mx.T @ (y0 ** 2)
+    sxy = x0.T @ y0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx ** 2) * (n * syy - sy ** 2))
+    r[n < CORRELATION_MIN_PAIRS] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(np.int64)
+
+
+def shift_rows(x, lag):
+    # x[t - lag] at row t (NaN where undefined), i.e. a positive lag pairs a bead with an earlier status
+    shifted = np.full_like(x, np.nan)
+    if lag > 0:
+        shifted[lag:] = x[:-lag]
+    elif lag < 0:
+        shifted[:lag] = x[-lag:]
+    else:
+        shifted[:] = x
+    return shifted
+
+
+@st.cache_data(show_spinner=False)
+def correlate_status_with_beads(_handles, archive_id, _status_wide, status_digest, time_offset, max_lag):
+    # Ranked table (one row per series x bead) and the Pearson matrix for the heatmap
+    capture_times, signals, beads = load_capture_matrix(_handles)
+    status = align_status_to_captures(capture_times, _status_wide, time_offset)
+    signals = signals.astype(np.float64)
+
+    pearson, n_pairs = pairwise_pearson(status, signals)
+    # Spearman = Pearson on ranks; ranks are taken over the captures each series actually covers.
+    # Series with the same coverage share one ranking pass of the signal matrix
+    spearman = np.full_like(pearson, np.nan)
+    patterns, pattern_of = np.unique(~np.isnan(status).T, axis=0, return_inverse=True)
+    for p, rows in enumerate(patterns):
+        if rows.sum() >= CORRELATION_MIN_PAIRS:
+            cols = np.flatnonzero(pattern_of.ravel() == p)
+            spearman[cols] = pairwise_pearson(
+                pd.DataFrame(status[np.ix_(rows, cols)]).rank().to_numpy(),
+                pd.DataFrame(signals[rows]).rank().to_numpy(),
+            )[0]
+
+    # Lagged correlation over whole-capture shifts; keep the lag with the largest |r|
+    lags = np.arange(-max_lag, max_lag + 1)
+    lagged = np.stack([pairwise_pearson(shift_rows(status, int(lag)), signals)[0] for lag in lags])
+    best = np.nanargmax(np.nan_to_num(np.abs(lagged), nan=-1.0), axis=0)
+    best_r = np.take_along_axis(lagged, best[None], axis=0)[0]
+
+    series = _status_wide.columns.tolist()
+    ranked = pd.DataFrame({
+        "status_series": np.repeat(series, len(beads)),
+        "bead": np.tile(beads, len(series)),
+        "pearson": pearson.ravel(),
+        "spearman": spearman.ravel(),
+        "best_lag_captures": lags[best].ravel(),
+        "lagged_r": best_r.ravel(),
+        "n": n_pairs.ravel(),
+    })
+    ranked = ranked.dropna(subset=["pearson"])
+    ranked = ranked.reindex(ranked["pearson"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+    heatmap = pd.DataFrame(pearson, index=series, columns=beads)
+    return ranked, heatmap
+
+# --- Rolling Anomaly Detection ---
+ANOMALY_MAD_SCALE = 1.4826  # MAD -> standard deviation for normally distributed signals
+ANOMALY_MIN_PERIODS = 10
+ANOMALY_MARKER_COLOR = "crimson"
+
+
+def rolling_robust_zscores(adjusted_times, block, window):
+    # Centered rolling median/MAD per bead column over adjusted time; NaN where the window is too
+    # sparse or the MAD is zero
+    frame = pd.DataFrame(block, index=pd.DatetimeIndex(adjusted_times))
+    rolling = dict(window=window, center=True, min_periods=ANOMALY_MIN_PERIODS)
+    median = frame.rolling(**rolling).median()
+    deviation = frame - median
+    mad = deviation.abs().rolling(**rolling).median()
+    return (deviation / (ANOMALY_MAD_SCALE * mad.where(mad > 0))).to_numpy()
+
+
+@st.cache_data(show_spinner=False)
+def detect_anomalies(_handles, archive_id, window_minutes, z_threshold):
+    # One row per flagged (capture, bead) across the archive, scored once per member
+    window = pd.Timedelta(minutes=window_minutes)
+    flagged = []
+    for member, handle in enumerate(_handles):
+        df_plot, _ = load_member(handle["path"])
+        captures = handle["captures"]
+        bead_names = df_plot["bead_number"].cat.categories
+        block = member_signal_block(df_plot, captures, len(bead_names))
+        first_rows = captures["row_start"].to_numpy()
+        adjusted_times = df_plot["adjusted_time"].to_numpy()[first_rows]
+
+        z = rolling_robust_zscores(adjusted_times, block, window)
+        capture_idx, bead_idx = np.nonzero(np.abs(np.nan_to_num(z)) >= z_threshold)
+        if len(capture_idx) == 0:
+            continue
+        flagged.append(pd.DataFrame({
+            "member": member,
+            "file": handle["name"],
+            "csv_name": df_plot["csv_name"].to_numpy()[first_rows[capture_idx]],
+            "bead": bead_names[bead_idx],
+            "original_time": captures["capture_time"].to_numpy()[capture_idx],
+            "adjusted_time": adjusted_times[capture_idx],
+            "signal": block[capture_idx, bead_idx],
+            "z_score": z[capture_idx, bead_idx].astype(np.float32),
+        }))
+
+    if not flagged:
+        return pd.DataFrame(columns=["member", "file", "csv_name", "bead", "original_time",
+                                     "adjusted_time", "signal", "z_score"])
+    anomalies = pd.concat(flagged, ignore_index=True)
+    return anomalies.reindex(anomalies["z_score"].abs().sort_values(ascending=False).index).reset_index(drop=True)
+
+
+def build_anomaly_trace(anomalies):
+    return go.Scatter(
+        x=anomalies["adjusted_time"],
+        y=anomalies["signal"],
+        mode="markers",
+        name="Anomalies",
+        marker=dict(symbol="x", size=9, color=ANOMALY_MARKER_COLOR),
+        customdata=np.column_stack([anomalies["bead"].astype(str), anomalies["z_score"].round(2)]),
+        hovertemplate=(
+            "Anomaly: %{customdata[0]}<br>Time: %{x|%Y-%m-%d %H:%M:%S}<br>"
+            "Signal: %{y:.2f}<br>Robust z: %{customdata[1]}<extra></extra>"
+        ),
+        yaxis="y1",
+    )
+
+# --- Aggregate Statistics (per day / bead / F-code) ---
+AGGREGATE_DIMENSIONS = {"Date": "date", "Bead": "bead_number", "F-code": "f_code"}
+AGGREGATE_PERCENTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def load_signal_frame(handles):
+    # Compact archive-wide frame (date, bead, F-code, signal); members are loaded one at a time
+    frames = []
+    for handle in handles:
+        df_plot, _ = load_member(handle["path"])
+        frames.append(pd.DataFrame({
+            "date": df_plot["original_time"].to_numpy().astype("datetime64[D]"),
+            "bead_number": df_plot["bead_number"].copy(),
+            "f_code": df_plot["f_code"].copy(),
+            "signal": df_plot["signal"].to_numpy(),
+        }))
+    return union_category_frames(frames)
+
+
+@st.cache_data(show_spinner=False)
+def aggregate_signal_stats(_handles, archive_id, dimensions):
+    # One groupby over the whole archive; quantiles reuse the same grouping
+    frame = load_signal_frame(_handles)
+    grouped = frame.groupby([AGGREGATE_DIMENSIONS[dim] for dim in dimensions], observed=True)["signal"]
+    stats = grouped.agg(["count", "mean", "std", "min", "max"])
+    percentiles = grouped.quantile(AGGREGATE_PERCENTILES).unstack()
+    percentiles.columns = [f"p{round(q * 100):02d}" for q in AGGREGATE_PERCENTILES]
+    stats = stats.join(percentiles).astype({"count": np.int64})
+    stats.index.names = list(dimensions)
+    return stats.reset_index()
+
+# --- Figure Building (cached per file) ---
+DEFAULT_FILES_PER_PAGE = 5
+FIGURE_MB_ESTIMATE = 5  # benchmark: ~5 MB of figure JSON per member
+FIGURE_CACHE_MAX_MB = 256
+# The bead-layer and figure caches are shared by all sessions: a few pages' worth each, and together
+# at most FIGURE_CACHE_MAX_MB; entries unused for FIGURE_CACHE_TTL are released
+FIGURE_CACHE_ENTRIES = min(4 * DEFAULT_FILES_PER_PAGE, FIGURE_CACHE_MAX_MB // (2 * FIGURE_MB_ESTIMATE))
+FIGURE_CACHE_TTL = pd.Timedelta(hours=1)
+STATUS_TRACE_COLOR = "rgba(100,100,100,0.2)"
+STATUS_EXTRA_COLORS = ["rgba(27,158,119,0.5)", "rgba(217,95,2,0.5)", "rgba(117,112,179,0.5)",
+                       "rgba(231,41,138,0.5)", "rgba(102,166,30,0.5)", "rgba(230,171,2,0.5)"]
+STATUS_AXIS_SPACING = 0.06
+
+
+def downsample_series(series, budget):
+    # Min/max per positional bucket keeps spikes and steps visible at ~budget points
+    if len(series) <= budget:
+        return series
+    n_buckets = max(budget // 2, 1)
+    buckets = np.arange(len(series)) * n_buckets // len(series)
+    values = series.reset_index(drop=True)
+    keep = np.union1d(values.groupby(buckets).idxmin(), values.groupby(buckets).idxmax())
+    return series.iloc[keep]
+
+
+def build_status_trace(series, time_offset, time_window, status_plot_type, label, yaxis, color):
+    # series is one column of the wide status table, still on the PLC clock; only the samples in the
+    # window (plus one either side, so lines reach the edges) are shipped, at most ~TRACE_POINT_BUDGET
+    plc_times = series.index.to_numpy()
+    lo = np.searchsorted(plc_times, np.datetime64(pd.Timestamp(time_window[0]) + time_offset, "ns"))
+    hi = np.searchsorted(plc_times, np.datetime64(pd.Timestamp(time_window[1]) + time_offset, "ns"), side="right")
+    series = downsample_series(series.iloc[max(lo - 1, 0):hi + 1], TRACE_POINT_BUDGET)
+    common = dict(
+        x=series.index - time_offset,
+        y=series.to_numpy(),
+        name=f"Status: {label}",
+        yaxis=yaxis,
+        opacity=0.8,
+        hovertemplate=f"Status: {label}<br>Time: %{{x|%Y-%m-%d %H:%M:%S}}<br>Status Value: %{{y}}<extra></extra>",
+    )
+    if status_plot_type == "Scatter":
+        return go.Scatter(mode="markers", marker=dict(color=color), **common)
+    if status_plot_type == "Step":
+        return go.Scatter(mode="lines", line=dict(shape="hv", color=color), **common)
+    return go.Scatter(mode="lines", line=dict(width=2, dash="dot", color=color), **common)
+
+
+def status_axes_layout(labels):
+    # First series uses yaxis2 on the plot's right edge, further series get free axes to its right
+    x_domain_end = 1 - STATUS_AXIS_SPACING * max(len(labels) - 1, 0)
+    axes = {}
+    for j, label in enumerate(labels):
+        axis = dict(title=label if len(labels) > 1 else "Status Value", overlaying="y", side="right")
+        if j > 0:
+            axis.update(anchor="free", position=min(x_domain_end + STATUS_AXIS_SPACING * j, 1.0))
+        axes[f"yaxis{j + 2}"] = axis
+    return x_domain_end, axes
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, ttl=FIGURE_CACHE_TTL, show_spinner=False)
+def build_bead_layer(archive_id, csv_file_name, time_window, filter_key, _df_plot, _pyramid):
+    # Bead traces depend only on the file, the capture filters and the visible window, not on the
+    # status overlay. A filtered frame comes without a pyramid, so one is built for the subset here.
+    if _pyramid is None:
+        _pyramid = build_time_pyramid(_df_plot)
+    level_idx = select_pyramid_level(_df_plot, _pyramid, time_window)
+    if level_idx is None:
+        adjusted = _df_plot["adjusted_time"].to_numpy()
+        start = np.searchsorted(adjusted, np.datetime64(time_window[0], "ns"))
+        stop = np.searchsorted(adjusted, np.datetime64(time_window[1], "ns"), side="right")
+        return build_bead_traces(_df_plot.iloc[start:stop]), "Resolution: raw captures"
+
+    level = _pyramid[level_idx]
+    traces = build_pyramid_traces(level, _df_plot["bead_number"].cat.categories, time_window)
+    return traces, (
+        f"Resolution: {level['width']} buckets (mean line, min/max in hover) – "
+        "narrow the time window for more detail"
+    )
+
+
+@st.cache_resource(max_entries=FIGURE_CACHE_ENTRIES, ttl=FIGURE_CACHE_TTL, show_spinner=False)
+def build_file_figure(archive_id, csv_file_name, time_window, filter_key, status_key, status_plot_type,
+                      anomaly_key, _df_plot, _pyramid, _status_wide, _anomalies):
+    # status_key is (status digest, selected series labels, clock offset) or None when no status is overlaid;
+    # anomaly_key is (window minutes, z threshold) or None when anomalies are not marked
+    bead_traces, resolution = build_bead_layer(
+        archive_id, csv_file_name, time_window, filter_key, _df_plot, _pyramid
+    )
+    labels = status_key[1] if status_key is not None else ()
+    x_domain_end, status_axes = status_axes_layout(labels)
+
+    fig = go.Figure()
+    # Plot status data first
+    for j, label in enumerate(labels):
+        color = STATUS_TRACE_COLOR if j == 0 else STATUS_EXTRA_COLORS[(j - 1) % len(STATUS_EXTRA_COLORS)]
+        fig.add_trace(build_status_trace(
+            _status_wide[label].dropna(), status_key[2], time_window, status_plot_type, label, f"y{j + 2}", color
+        ))
+    fig.add_traces(bead_traces)
+    if anomaly_key is not None and not _anomalies.empty:
+        lo, hi = pd.Timestamp(time_window[0]), pd.Timestamp(time_window[1])
+        fig.add_trace(build_anomaly_trace(_anomalies[_anomalies["adjusted_time"].between(lo, hi)]))
+
+    fig.update_layout(
+        title=f"Signal per Bead – from {csv_file_name}",
+        xaxis_title="Time (ZIP + Status Combined)",
+        yaxis=dict(title="Signal", side="left"),
+        height=500,
+        legend_title="Bead / Status",
+        hovermode="closest",
+        xaxis=dict(range=list(time_window), domain=[0, x_domain_end]),
+        **(status_axes or {"yaxis2": dict(title="Status Value", overlaying="y", side="right")}),
+    )
+    return fig, resolution
 
 # --- Main Execution ---
+chunk_budget_mb = st.sidebar.number_input(
+    "CSV read chunk budget (MB)", min_value=64, max_value=16384, value=DEFAULT_CHUNK_BUDGET_MB, step=64
+)
+
 if uploaded_zip:
     with st.spinner("Processing bead signal ZIP file..."):
-        plots_data, all_bead_times = process_zip(uploaded_zip)
+        handles, zip_time_range, capture_index, ingest_counts = load_archive(
+            uploaded_zip, incremental=incremental_ingest, chunk_budget_mb=chunk_budget_mb
+        )
+    if handles:
+        st.caption(
+            f"{len(handles)} file(s), {sum(handle['n_rows'] for handle in handles):,} bead rows, "
+            f"captures from {zip_time_range[0]} to {zip_time_range[1]}"
+        )
+    if incremental_ingest:
+        st.caption(
+            f"Ingestion: {ingest_counts['reused']} file(s) reused, "
+            f"{ingest_counts['appended']} appended, {ingest_counts['parsed']} parsed"
+        )
 
-    if not plots_data:
+    if not handles:
         st.warning("No valid CSV data found in ZIP.")
     else:
+        status_key = None
+        status_wide = None
         if status_csv:
-            df_status = process_status_csv(status_csv)
-            stat1_options = df_status["Stat1"].dropna().unique().tolist()
-            selected_stat1 = st.sidebar.selectbox("Select Stat1", stat1_options)
+            digest = status_file_digest(status_csv, status_csv.file_id)
+            if not has_status_columns(status_csv):
+                st.warning("Machine status CSV needs Timestamp, Stat1, Stat2 and Value columns.")
+            else:
+                with st.spinner("Pivoting machine status CSV..."):
+                    status_wide = load_status_wide(status_csv, digest)
+                non_numeric = status_wide.attrs.get("non_numeric", {})
+                if non_numeric:
+                    st.sidebar.warning("Non-numeric status values ignored: " + ", ".join(
+                        f"{label} ({n:,} row(s){'' if label in status_wide.columns else ', series dropped'})"
+                        for label, n in non_numeric.items()
+                    ))
 
-            stat2_options = df_status[df_status["Stat1"] == selected_stat1]["Stat2"].dropna().unique().tolist()
-            selected_stat2 = st.sidebar.selectbox("Select Stat2", stat2_options)
+                # Any number of series can be overlaid; adding or removing one only changes the figure
+                series_options = status_wide.columns.tolist()
+                selected_series = st.sidebar.multiselect(
+                    "Status series (Stat1-Stat2, one axis each)", series_options, default=series_options[:1]
+                )
 
-            df_status_filtered = df_status[
-                (df_status["Stat1"] == selected_stat1) &
-                (df_status["Stat2"] == selected_stat2)
-            ].copy()
-        else:
-            df_status_filtered = None
-
-        zip_min_time = min(all_bead_times)
-        zip_max_time = max(all_bead_times)
-
-        for csv_file_name, df_plot in plots_data:
-            st.subheader(f"📄 Plot from file: {csv_file_name}")
-
-            fig = go.Figure()
-
-            # Plot status data first
-            if df_status_filtered is not None and not df_status_filtered.empty:
-                if status_plot_type == "Scatter":
-                    fig.add_trace(go.Scatter(
-                        x=df_status_filtered["Timestamp"],
-                        y=df_status_filtered["Value"],
-                        mode="markers",
-                        name=f"Status: {selected_stat1}-{selected_stat2}",
-                        marker=dict(color="rgba(100,100,100,0.2)"),
-                        yaxis="y2",
-                        opacity=0.8,
-                        hovertemplate="Time: %{x|%Y-%m-%d %H:%M:%S}<br>Status Value: %{y}<extra></extra>",
-                    ))
-                elif status_plot_type == "Step":
-                    fig.add_trace(go.Scatter(
-                        x=df_status_filtered["Timestamp"],
-                        y=df_status_filtered["Value"],
-                        mode="lines",
-                        name=f"Status: {selected_stat1}-{selected_stat2}",
-                        line=dict(shape="hv", color="rgba(100,100,100,0.2)"),
-                        yaxis="y2",
-                        opacity=0.8,
-                        hovertemplate="Time: %{x|%Y-%m-%d %H:%M:%S}<br>Status Value: %{y}<extra></extra>",
-                    ))
-                else:
-                    fig.add_trace(go.Scatter(
-                        x=df_status_filtered["Timestamp"],
-                        y=df_status_filtered["Value"],
-                        mode="lines",
-                        name=f"Status: {selected_stat1}-{selected_stat2}",
-                        line=dict(width=2, dash="dot", color="rgba(100,100,100,0.2)"),
-                        yaxis="y2",
-                        hovertemplate="Time: %{x|%Y-%m-%d %H:%M:%S}<br>Status Value: %{y}<extra></extra>",
-                        opacity=0.8
-                    ))
+                offset_mode = st.sidebar.radio("Status clock offset", ["Auto (FFT)", "Manual"], index=0)
+                time_offset = STATUS_TIME_OFFSET
+                if offset_mode == "Manual":
+                    offset_seconds = st.sidebar.number_input(
+                        "Offset (s, subtracted from status time)", value=STATUS_TIME_OFFSET.total_seconds(), step=1.0
+                    )
+                    time_offset = pd.Timedelta(seconds=offset_seconds)
+                elif selected_series:
+                    # The first selected series is the reference for the estimate
+                    reference = status_wide[selected_series[0]].dropna()
+                    search_minutes = st.sidebar.number_input("Offset search window (± min)", 1, 240, 15)
+                    estimate = estimate_status_offset(
+                        handles, uploaded_zip.file_id, reference, digest, selected_series[0], search_minutes,
+                    )
+                    if estimate is not None and estimate[1] >= OFFSET_MIN_CONFIDENCE:
+                        time_offset = estimate[0]
+                        st.sidebar.caption(
+                            f"Estimated offset from {selected_series[0]}: {time_offset} (confidence {estimate[1]:.2f})"
+                        )
+                    else:
+                        confidence = "n/a" if estimate is None else f"{estimate[1]:.2f}"
+                        st.sidebar.caption(
+                            f"Offset estimate not confident ({confidence}); using default {STATUS_TIME_OFFSET}"
+                        )
+
+                if selected_series:
+                    status_key = (digest, tuple(selected_series), time_offset)
 
-            for bead in df_plot["bead_number"].unique():
-                sub = df_plot[df_plot["bead_number"] == bead]
-                fig.add_trace(go.Scatter(
-                    x=sub["adjusted_time"],
-                    y=sub["signal"],
-                    mode="lines",
-                    name=bead,
-                    line=dict(width=1),
-                    customdata=sub[["csv_name", "original_time"]],
-                    hovertemplate=(
-                        f"Bead: {bead}<br>"
-                        f"Original Time: %{{customdata[1]|%Y-%m-%d %H:%M:%S}}<br>"
-                        f"Signal: %{{y:.2f}}<br>"
-                        f"File: %{{customdata[0]}}<extra></extra>"
-                    ),
-                    yaxis="y1"
+        if status_wide is not None and st.sidebar.checkbox("Show status vs bead correlation", value=False):
+            max_lag = st.sidebar.number_input("Max correlation lag (captures)", 0, 50, 5)
+            with st.spinner("Correlating status series with bead signals..."):
+                ranked, heatmap = correlate_status_with_beads(
+                    handles, uploaded_zip.file_id, status_wide, digest, time_offset, max_lag
+                )
+            with st.expander("📈 Status vs bead correlation", expanded=True):
+                fig_corr = go.Figure(go.Heatmap(
+                    z=heatmap.to_numpy(), x=heatmap.columns, y=heatmap.index,
+                    zmin=-1, zmax=1, colorscale="RdBu_r", colorbar=dict(title="Pearson r"),
                 ))
+                fig_corr.update_layout(
+                    title="Pearson correlation: status series (aligned to captures) vs bead signal",
+                    height=max(300, 40 * len(heatmap) + 150),
+                )
+                st.plotly_chart(fig_corr, use_container_width=True)
+                st.dataframe(ranked, use_container_width=True)
+                st.download_button(
+                    "Download correlation table (CSV)",
+                    data=ranked.to_csv(index=False).encode("utf-8"),
+                    file_name="status_bead_correlation.csv",
+                    mime="text/csv",
+                )
 
-            fig.update_layout(
-                title=f"Signal per Bead – from {csv_file_name}",
-                xaxis_title="Time (ZIP + Status Combined)",
-                yaxis=dict(title="Signal", side="left"),
-                yaxis2=dict(title="Status Value", overlaying="y", side="right"),
-                height=500,
-                legend_title="Bead / Status",
-                hovermode="closest",
-                xaxis=dict(range=[zip_min_time, zip_max_time])
+        anomaly_key = None
+        anomalies = None
+        if st.sidebar.checkbox("Mark anomalies (rolling robust z-score)", value=False):
+            anomaly_window = st.sidebar.number_input("Anomaly window (min of adjusted time)", 1, 1440, 30)
+            anomaly_threshold = st.sidebar.number_input("Anomaly |z| threshold", 1.0, 20.0, 3.5, step=0.5)
+            with st.spinner("Scoring captures per bead..."):
+                anomalies = detect_anomalies(handles, uploaded_zip.file_id, anomaly_window, anomaly_threshold)
+            anomaly_key = (anomaly_window, anomaly_threshold)
+            with st.expander(f"🚩 Flagged captures ({len(anomalies):,})", expanded=False):
+                st.dataframe(anomalies.drop(columns="member"), use_container_width=True)
+                st.download_button(
+                    "Download flagged captures (CSV)",
+                    data=anomalies.drop(columns="member").to_csv(index=False).encode("utf-8"),
+                    file_name="nvh_anomalies.csv",
+                    mime="text/csv",
+                )
+
+        if st.sidebar.checkbox("Show aggregate statistics", value=False):
+            dimensions = st.sidebar.multiselect(
+                "Aggregate by", list(AGGREGATE_DIMENSIONS), default=list(AGGREGATE_DIMENSIONS)
             )
+            if dimensions:
+                with st.spinner("Aggregating bead signals..."):
+                    aggregates = aggregate_signal_stats(handles, uploaded_zip.file_id, tuple(dimensions))
+                with st.expander(f"📊 Signal statistics by {' / '.join(dimensions)}", expanded=True):
+                    stat_columns = [col for col in aggregates.columns if col not in dimensions]
+                    pivot_col1, pivot_col2 = st.columns(2)
+                    pivot_columns = pivot_col1.selectbox("Pivot columns", ["(none)"] + dimensions)
+                    pivot_value = pivot_col2.selectbox("Statistic", stat_columns, index=stat_columns.index("mean"))
+                    rows = [dim for dim in dimensions if dim != pivot_columns]
+                    if pivot_columns == "(none)":
+                        table = aggregates
+                    elif not rows:
+                        table = aggregates.set_index(pivot_columns)[[pivot_value]].T
+                    else:
+                        table = aggregates.pivot(index=rows, columns=pivot_columns, values=pivot_value)
+                    st.dataframe(table, use_container_width=True)
+                    st.download_button(
+                        "Download statistics (CSV)",
+                        data=aggregates.to_csv(index=False).encode("utf-8"),
+                        file_name="nvh_signal_statistics.csv",
+                        mime="text/csv",
+                    )
 
+        # The visible time window picks the pyramid level, so the payload stays bounded at any zoom
+        span_min = min(handle["adjusted_range"][0] for handle in handles).to_pydatetime()
+        span_max = max(handle["adjusted_range"][1] for handle in handles).to_pydatetime()
+        if span_min < span_max:
+            time_window = st.sidebar.slider(
+                "Time window", min_value=span_min, max_value=span_max,
+                value=(span_min, span_max), step=timedelta(minutes=1), format="YYYY-MM-DD HH:mm",
+            )
+        else:
+            time_window = (span_min, span_max)
+
+        # Capture filters are answered from the capture index; frames are only sliced by row range
+        st.sidebar.header("Capture Filters")
+        first_day, last_day = zip_time_range[0].date(), zip_time_range[1].date()
+        date_range = st.sidebar.date_input(
+            "Capture dates", value=(first_day, last_day), min_value=first_day, max_value=last_day
+        )
+        if not isinstance(date_range, (tuple, list)) or len(date_range) != 2:
+            date_range = (first_day, last_day)
+        selected_bm = st.sidebar.multiselect("BM code", capture_index["bm_code"].cat.categories.tolist())
+        selected_f = st.sidebar.multiselect("F-code", capture_index["f_code"].cat.categories.tolist())
+        selected_stat_suffix = st.sidebar.multiselect(
+            "Stat suffix", capture_index["stat_suffix"].cat.categories.tolist(),
+            format_func=lambda v: v or "(none)",
+        )
+        max_beads = max(handle["n_beads"] for handle in handles)
+        selected_beads = st.sidebar.multiselect("Beads", [f"Bead {i:02d}" for i in range(1, max_beads + 1)])
+
+        filter_active = (
+            tuple(date_range) != (first_day, last_day)
+            or bool(selected_bm or selected_f or selected_stat_suffix or selected_beads)
+        )
+        filter_key = (
+            (tuple(date_range), tuple(selected_bm), tuple(selected_f),
+             tuple(selected_stat_suffix), tuple(selected_beads)) if filter_active else None
+        )
+        matched = query_captures(capture_index, date_range, selected_bm, selected_f, selected_stat_suffix)
+        member_ranges = {
+            member: (group["row_start"].to_numpy(), group["row_stop"].to_numpy())
+            for member, group in matched.sort_values("row_start").groupby("member", sort=True)
+        }
+        visible_members = list(member_ranges) if filter_active else list(range(len(handles)))
+        if filter_active:
+            st.caption(f"{len(matched):,} capture(s) in {len(visible_members)} file(s) match the filters")
+        if not visible_members:
+            st.info("No captures match the current filters.")
+            st.stop()
+
+        # Only the current page's figures are built; everything built is cached per file
+        files_per_page = st.sidebar.number_input(
+            "Files per page", min_value=1, max_value=FIGURE_CACHE_ENTRIES, value=DEFAULT_FILES_PER_PAGE
+        )
+        n_pages = -(-len(visible_members) // files_per_page)
+        page = st.sidebar.number_input("Page", min_value=1, max_value=n_pages, value=1) if n_pages > 1 else 1
+        first = (page - 1) * files_per_page
+        page_members = visible_members[first:first + files_per_page]
+        st.caption(
+            f"Showing files {first + 1}–{first + len(page_members)} of {len(visible_members)} (page {page}/{n_pages})"
+        )
+
+        for member in page_members:
+            handle = handles[member]
+            st.subheader(f"📄 Plot from file: {handle['name']}")
+            df_plot, pyramid = load_member(handle["path"])
+            if filter_active:
+                starts, stops = member_ranges[member]
+                df_plot = df_plot.iloc[ranges_to_rows(starts, stops)]
+                if selected_beads:
+                    df_plot = df_plot[df_plot["bead_number"].isin(selected_beads)]
+                    df_plot = df_plot.assign(bead_number=df_plot["bead_number"].cat.remove_unused_categories())
+                pyramid = None
+                if df_plot.empty:
+                    st.info("No rows left after the bead filter.")
+                    continue
+
+            member_anomalies = None
+            if anomaly_key is not None:
+                member_anomalies = anomalies[anomalies["member"] == member]
+                if filter_active:
+                    member_anomalies = member_anomalies[
+                        member_anomalies["adjusted_time"].isin(df_plot["adjusted_time"])
+                        & member_anomalies["bead"].isin(df_plot["bead_number"].unique())
+                    ]
+
+            fig, resolution = build_file_figure(
+                uploaded_zip.file_id, handle["name"], time_window, filter_key, status_key, status_plot_type,
+                anomaly_key, df_plot, pyramid, status_wide, member_anomalies,
+            )
+            st.caption(resolution)
             st.plotly_chart(fig, use_container_width=True)
@@ -1,6 +1,12 @@
 # streamlit_app.py
 # Run: streamlit run streamlit_app.py
 
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
 import streamlit as st
 import numpy as np
 import pandas as pd
@@ -12,7 +18,18 @@ import plotly.express as px
 st.set_page_config(page_title="PCA Explorer (2D/3D) — Plotly", layout="wide")
 
 REQUIRED_COLS = ["Class", "Sub-class", "Stat", "Channel", "Metrics", "Bead", "Value"]
+TEXT_COLS = ["Class", "Sub-class", "Stat", "Channel", "Metrics", "Bead"]
 AGG_FUNCS = {"mean": "mean", "median": "median", "min": "min", "max": "max", "sum": "sum"}
+PCA_TIE_TOL = 1e-9  # relative gap below which batched PCA defers to sklearn (see fit_pca_batched)
+EXPECTED_METRICS = ["SUMP_L", "SUMP_U", "MAXP_L", "MAXP_U"]
+STAGE_CACHE_ENTRIES = 8
+PCA_CHUNK_GROUPS = 32  # groups per worker task
+PCA_WORKERS = min(8, os.cpu_count() or 1)
+WEBGL_MIN_POINTS = 1000  # 2-D plots above this render with WebGL instead of SVG
+DEFAULT_PLOT_POINTS = 50_000  # per figure; larger groups are decimated for plotting only
+MIN_POINTS_PER_CATEGORY = 200  # decimation floor, so small color categories stay visible
+GROUPS_PER_PAGE = 10
+ARTEFACT_CACHE_ENTRIES = 64  # built figures / download tables kept across reruns
 
 
 # =========================
@@ -30,35 +47,66 @@ def read_long_table(uploaded_file) -> pd.DataFrame:
 def add_metric_parts(df: pd.DataFrame) -> pd.DataFrame:
     """
     Metrics expected like: SUMP_L, SUMP_U, MAXP_L, MAXP_U
-    Adds MetricFamily (SUMP/MAXP) and MetricBound (L/U).
+    Adds MetricFamily (SUMP/MAXP) and MetricBound (L/U) as categoricals.
+    Only the distinct Metrics values are split; rows just map their category codes,
+    and the input columns are shared with the result, not copied.
     """
-    out = df.copy()
-    parts = out["Metrics"].astype(str).str.split("_", n=1, expand=True)
-    out["MetricFamily"] = parts[0]
-    out["MetricBound"] = parts[1] if parts.shape[1] > 1 else ""
-    out["MetricBound"] = out["MetricBound"].astype(str).str.upper()
-    return out
+    metrics = df["Metrics"]
+    if not isinstance(metrics.dtype, pd.CategoricalDtype):
+        metrics = metrics.astype("category")
+    codes = metrics.cat.codes.to_numpy()
+    parts = pd.Series(metrics.cat.categories.astype(str)).str.split("_", n=1, expand=True)
+    parts = parts.reindex(columns=range(max(parts.shape[1], 1)))  # no Metrics at all -> one empty column
+
+    def from_parts(values: pd.Series) -> pd.Categorical:
+        per_category = pd.Categorical(values)
+        # Code -1 (missing Metrics) picks the appended -1 and stays missing
+        part_codes = np.append(per_category.codes, -1)[codes]
+        return pd.Categorical.from_codes(part_codes, dtype=per_category.dtype)
+
+    if parts.shape[1] > 1:
+        bound = from_parts(parts[1].str.upper())
+    else:
+        bound = pd.Categorical([""] * len(df))
+    return df.assign(MetricFamily=from_parts(parts[0]), MetricBound=bound)
 
 
-def pivot_wide(df: pd.DataFrame, id_cols: list[str], agg: str) -> tuple[pd.DataFrame, list[str]]:
+def pivot_groups(
+    df: pd.DataFrame, id_cols: list[str], group_cols: list[str], agg: str
+) -> tuple[list[tuple], dict[int, tuple[pd.DataFrame, list[str]]]]:
     """
-    Always pivot by Metrics => columns like SUMP_L, SUMP_U, MAXP_L, MAXP_U (or subset if filtered).
+    One pivot by Metrics over id_cols + group_cols, split into per-group wide tables.
+    Returns (group keys in sorted order, {group index: (wide, feat_cols)}).
+    Each group's wide table matches a pivot_table on that group alone: rows with a missing
+    id or with all features NaN are dropped, and so are feature columns that are all NaN in the group.
     """
-    tmp = df.copy()
-    tmp["_feature_"] = tmp["Metrics"].astype(str)
-
-    wide = (
-        tmp.pivot_table(
-            index=id_cols,
-            columns="_feature_",
-            values="Value",
-            aggfunc=AGG_FUNCS[agg],
-        )
-        .reset_index()
+    if group_cols:
+        grouped = df.groupby(group_cols, dropna=False, sort=True, observed=True)
+        group_codes = grouped.ngroup().to_numpy()
+        keys = [key if isinstance(key, tuple) else (key,) for key in grouped.size().index]
+    else:
+        group_codes = np.zeros(len(df), dtype=np.int64)
+        keys = [tuple()]
+
+    # Grouped on the columns themselves (categorical codes for the Parquet layout): rows with a
+    # missing id or Metrics fall out of the groupby, so no filtered copy of the table is made
+    keys_by = [pd.Series(group_codes, index=df.index, name="_group_"), *(df[c] for c in id_cols),
+               df["Metrics"].rename("_feature_")]
+    shared = (
+        df["Value"].groupby(keys_by, sort=True, observed=True)
+        .agg(AGG_FUNCS[agg])
+        .unstack("_feature_")
     )
-    wide.columns.name = None
-    feat_cols = [c for c in wide.columns if c not in id_cols]
-    return wide, feat_cols
+    shared = shared.loc[shared.notna().any(axis=1)]
+    shared.columns = shared.columns.astype(str)
+    shared.columns.name = None
+
+    groups = {}
+    for code, part in shared.groupby(level="_group_", sort=False):
+        part = part.loc[:, part.notna().any(axis=0)]
+        wide = part.reset_index(level="_group_", drop=True).reset_index()
+        groups[code] = (wide, [c for c in wide.columns if c not in id_cols])
+    return keys, groups
 
 
 def fit_pca(wide: pd.DataFrame, id_cols: list[str], feat_cols: list[str], n_components: int, standardize: bool):
@@ -95,6 +143,124 @@ def fit_pca(wide: pd.DataFrame, id_cols: list[str], feat_cols: list[str], n_comp
     return out, var
 
 
+def eigh_components(cov: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Stacked (groups, features, features) covariances -> (eigenvalues, components), largest variance first.
+    Components are (groups, features, components) with sklearn's sign convention
+    (largest |loading| of each component positive).
+    """
+    eigenvals, eigenvecs = np.linalg.eigh(cov)
+    eigenvals = np.clip(eigenvals[:, ::-1], 0.0, None)
+    components = eigenvecs[:, :, ::-1]
+    max_rows = np.abs(components).argmax(axis=1)
+    components = components * np.sign(np.take_along_axis(components, max_rows[:, None, :], axis=1))
+    return eigenvals, components
+
+
+def fit_pca_batched(
+    wides: list[pd.DataFrame], id_cols: list[str], feat_cols: list[str], n_components: int, standardize: bool
+) -> list:
+    """
+    fit_pca for many wide tables sharing feat_cols, solved with one stacked eigh call:
+    - Per-group centering/scaling from segment sums, feature covariances via einsum
+    - Component signs follow sklearn (largest |loading| of each component positive)
+    - Tables with no more rows than features, an all-NaN feature, or components that are not
+      uniquely defined go through fit_pca itself
+    Returns, per table, (pca_df, explained variance ratio) or the exception fit_pca would raise.
+    """
+    results = [None] * len(wides)
+    n_features = len(feat_cols)
+    batch, kept, blocks = [], [], []
+    for i, wide in enumerate(wides):
+        X = wide[feat_cols].to_numpy(dtype=float)
+        keep = ~np.isnan(X).all(axis=1)
+        if keep.sum() <= n_features or np.isnan(X[keep]).all(axis=0).any():
+            try:
+                results[i] = fit_pca(wide, id_cols, feat_cols, n_components, standardize)
+            except Exception as e:
+                results[i] = e
+            continue
+        batch.append(i)
+        kept.append(keep)
+        blocks.append(X[keep])
+
+    if not batch:
+        return results
+
+    sizes = np.array([len(block) for block in blocks])
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    group_ids = np.repeat(np.arange(len(blocks)), sizes)
+    X = np.concatenate(blocks)
+
+    # Remaining NaNs -> column mean of the group
+    missing = np.isnan(X)
+    if missing.any():
+        with np.errstate(invalid="ignore", divide="ignore"):
+            col_means = np.add.reduceat(np.where(missing, 0.0, X), starts) / np.add.reduceat(~missing, starts)
+        X = np.where(missing, col_means[group_ids], X)
+
+    mean = np.add.reduceat(X, starts) / sizes[:, None]
+    X_used = X - mean[group_ids]
+    if standardize:
+        # Same constant-feature rule as StandardScaler (scale 1 for zero-variance columns)
+        var = np.add.reduceat(X_used ** 2, starts) / sizes[:, None]
+        eps = np.finfo(np.float64).eps
+        constant = var <= sizes[:, None] * eps * var + (sizes[:, None] * mean * eps) ** 2
+        X_used = X_used / np.where(constant, 1.0, np.sqrt(var))[group_ids]
+        # PCA re-centers the scaled data
+        X_used = X_used - (np.add.reduceat(X_used, starts) / sizes[:, None])[group_ids]
+
+    cov = np.add.reduceat(np.einsum("ni,nj->nij", X_used, X_used), starts) / (sizes - 1)[:, None, None]
+    eigenvals, components = eigh_components(cov)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratios = eigenvals / eigenvals.sum(axis=1, keepdims=True)
+    scores = np.einsum("ni,nik->nk", X_used, components[group_ids, :, :n_components])
+
+    # Where sklearn's own result hinges on rounding (tied eigenvalues, or two loadings of equal size
+    # deciding the sign, e.g. always for two standardized features), the group is refit with fit_pca
+    total = eigenvals.sum(axis=1, keepdims=True)
+    used = eigenvals[:, :n_components] > PCA_TIE_TOL * total
+    top_two = -np.sort(-np.abs(components[:, :, :n_components]), axis=1)[:, :2, :]
+    sign_tie = (top_two[:, 0, :] - top_two[:, 1, :]) <= PCA_TIE_TOL if n_features > 1 else np.zeros_like(used)
+    next_vals = eigenvals[:, 1:n_components + 1]
+    value_tie = np.zeros_like(used)
+    value_tie[:, :next_vals.shape[1]] = (eigenvals[:, :next_vals.shape[1]] - next_vals) <= PCA_TIE_TOL * total
+    ambiguous = (used & (sign_tie | value_tie)).any(axis=1)
+
+    for b, i in enumerate(batch):
+        if ambiguous[b]:
+            try:
+                results[i] = fit_pca(wides[i], id_cols, feat_cols, n_components, standardize)
+            except Exception as e:
+                results[i] = e
+            continue
+        Z = scores[starts[b]:starts[b] + sizes[b]]
+        out = wides[i] if kept[b].all() else wides[i].loc[kept[b]]
+        out = out.assign(
+            PC1=Z[:, 0],
+            PC2=Z[:, 1] if n_components >= 2 else 0.0,
+            PC3=Z[:, 2] if n_components >= 3 else 0.0,
+        )
+        results[i] = (out, ratios[b, :n_components])
+    return results
+
+
+def decimate_by_category(df: pd.DataFrame, color_col: str, budget: int) -> pd.DataFrame:
+    """
+    Stratified random sample of about budget rows: each color category keeps its proportional
+    share, but at least MIN_POINTS_PER_CATEGORY rows (or all of them). Row order is kept, and
+    the fixed seed gives the same points on every rerun.
+    """
+    if len(df) <= budget:
+        return df
+    codes, _ = pd.factorize(df[color_col], use_na_sentinel=False)
+    counts = np.bincount(codes)
+    quota = np.minimum(counts, np.maximum(counts * budget // len(df), MIN_POINTS_PER_CATEGORY))
+    order = np.random.default_rng(0).permutation(len(df))
+    rank = pd.Series(codes[order]).groupby(codes[order]).cumcount().to_numpy()
+    return df.iloc[np.sort(order[rank < quota[codes[order]]])]
+
+
 def is_valid_hex(s: str) -> bool:
     s = (s or "").strip()
     if not s.startswith("#"):
@@ -112,26 +278,357 @@ def safe_str(x) -> str:
     return "" if pd.isna(x) else str(x)
 
 
-def make_group_keys(df: pd.DataFrame, group_cols: list[str]) -> list[tuple]:
-    if not group_cols:
-        return [tuple()]
-    keys = (
-        df[group_cols]
-        .drop_duplicates()
-        .sort_values(group_cols)
-        .apply(lambda r: tuple(r.values.tolist()), axis=1)
-        .tolist()
+# =========================
+# Cached pipeline stages
+# =========================
+# Every stage is keyed by the upload's content hash plus the parameters it depends on, so
+# presentation-only changes (height, coloring, HEX map) rerun none of them.
+# Stages return shared objects (cache_resource): callers must copy before mutating.
+PARQUET_DIR = Path(".k2_cache") / "parquet"
+
+
+@st.cache_data(show_spinner=False)
+def file_digest(_uploaded_file, file_id: str) -> str:
+    return hashlib.sha1(_uploaded_file.getvalue()).hexdigest()
+
+
+def to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """Text columns as categoricals and Value as float32, in place (the layout of the Parquet copy)."""
+    for col in TEXT_COLS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    if "Value" in df.columns:
+        df["Value"] = df["Value"].astype(np.float32)
+    return df
+
+
+@st.cache_resource(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def load_stage(digest: str, _uploaded_file) -> pd.DataFrame:
+    """
+    The upload is parsed once (openpyxl is slow on large workbooks) and kept as a Parquet copy
+    named by its content hash, which later reruns, sessions and restarts read instead.
+    """
+    path = PARQUET_DIR / f"{digest}.parquet"
+    if path.exists():
+        # Arrow restores only string dictionaries as categoricals (a numeric Bead comes back dense)
+        return to_columnar(pd.read_parquet(path))
+
+    _uploaded_file.seek(0)
+    df = to_columnar(read_long_table(_uploaded_file))
+    PARQUET_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        df.to_parquet(tmp_path, index=False)
+        tmp_path.replace(path)
+    except (ImportError, TypeError, ValueError):
+        # No Parquet engine, or mixed-type columns Arrow cannot store: keep using the parsed frame
+        tmp_path.unlink(missing_ok=True)
+    return df
+
+
+@st.cache_resource(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def metric_stage(digest: str, _df_long: pd.DataFrame) -> pd.DataFrame:
+    return add_metric_parts(_df_long)
+
+
+@st.cache_resource(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def color_categories_stage(digest: str, color_by: str, _df_long: pd.DataFrame) -> list[str]:
+    if color_by not in _df_long.columns:
+        return []
+    return sorted({str(v) for v in _df_long[color_by].unique()})
+
+
+@st.cache_resource(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def pivot_stage(
+    digest: str, id_cols: tuple, group_cols: tuple, agg: str, _df_long: pd.DataFrame
+) -> tuple[list[tuple], list[pd.DataFrame]]:
+    """
+    Group keys + one wide table per group, with all EXPECTED_METRICS present
+    (missing metric columns and remaining NaN set to 0, which prevents zero rows from disappearing).
+    """
+    keys, group_pivots = pivot_groups(_df_long, id_cols=list(id_cols), group_cols=list(group_cols), agg=agg)
+    wides = []
+    for i in range(len(keys)):
+        # If grouping by MetricBound, within a group only U or only L => fewer metric columns will exist.
+        wide, _ = group_pivots.get(i, (pd.DataFrame(columns=list(id_cols)), []))
+        wide = wide.copy()
+        for m in EXPECTED_METRICS:
+            if m not in wide.columns:
+                wide[m] = 0.0  # create missing metric column as 0
+        wide[EXPECTED_METRICS] = wide[EXPECTED_METRICS].astype(float).fillna(0.0)
+        wides.append(wide)
+    return keys, wides
+
+
+@st.cache_resource(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def pca_stage(
+    digest: str, id_cols: tuple, group_cols: tuple, agg: str, standardize: bool, n_components: int
+) -> dict:
+    """
+    PCA results of one pivot by group index ((pca_df, explained variance ratio) or an exception).
+    Starts empty and is filled as run_pca_chunks finishes groups, so a rerun only computes the rest.
+    """
+    return {}
+
+
+def run_pca_chunks(wides: list[pd.DataFrame], todo: list[int], id_cols: list[str], n_components: int, standardize: bool):
+    """
+    Fits the groups in todo on a thread pool, PCA_CHUNK_GROUPS groups per fit_pca_batched call
+    (the stacked eigh and the reductions run in NumPy without the GIL).
+    Yields {group index: result} per chunk, in completion order.
+    """
+    chunks = [todo[i:i + PCA_CHUNK_GROUPS] for i in range(0, len(todo), PCA_CHUNK_GROUPS)]
+    pool = ThreadPoolExecutor(max_workers=PCA_WORKERS)
+    try:
+        futures = {
+            pool.submit(
+                fit_pca_batched, [wides[i] for i in chunk], id_cols=id_cols, feat_cols=EXPECTED_METRICS,
+                n_components=n_components, standardize=standardize,
+            ): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                results = [e] * len(chunk)
+            yield dict(zip(chunk, results))
+    finally:
+        # A rerun abandons the generator: chunks not started yet are dropped
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# =========================
+# Out-of-core mode (chunked CSV)
+# =========================
+# Pass 1 reads the CSV in chunks, reduces each chunk to partial aggregates per (group, id, metric)
+# and spills them to hash partitions on disk. Each partition is then finalized into wide rows and
+# folded into per-group streaming covariances; PCA is solved from those. Pass 2 projects the wide
+# partitions, appends the scores to a CSV on disk and keeps a per-group random sample for plotting.
+# Working memory is bounded by the chunk and partition sizes, not by the size of the table.
+OOC_DIR = Path(".k2_cache") / "out_of_core"
+OOC_DEFAULT_CHUNK_ROWS = 500_000
+OOC_PARTITION_BYTES = 64 * 2**20  # CSV bytes per hash partition
+OOC_MIN_PARTITIONS = 8
+OOC_PLOT_POINTS = 5000  # sampled points per figure
+OOC_PARTIAL_AGGS = {"mean": ["sum", "count"], "min": ["min"], "max": ["max"], "sum": ["sum"]}
+OOC_COMBINE = {"sum": "sum", "count": "sum", "min": "min", "max": "max"}
+NAN_TOKEN = "\x00nan"
+
+
+def read_csv_chunks(uploaded_file, chunk_rows: int, usecols: list[str]):
+    uploaded_file.seek(0)
+    dtypes = {c: str for c in TEXT_COLS if c in usecols}
+    return pd.read_csv(uploaded_file, usecols=usecols, dtype=dtypes, chunksize=chunk_rows)
+
+
+def group_tokens(df: pd.DataFrame, group_cols: list[str]) -> pd.Series:
+    """One string per row naming its group; NaN is kept as a group value of its own."""
+    token = pd.Series("", index=df.index)
+    for i, col in enumerate(group_cols):
+        part = df[col].astype(object).where(df[col].notna(), NAN_TOKEN).astype(str)
+        token = part if i == 0 else token + "\x1f" + part
+    return token
+
+
+def ooc_spill_partials(
+    uploaded_file, work_dir: Path, id_cols: list[str], group_cols: list[str], agg: str,
+    chunk_rows: int, n_partitions: int,
+) -> dict[str, tuple]:
+    """
+    Pass 1: chunk -> partial aggregates per (group, id, metric), written to hash partitions.
+    Returns {group token: group values}.
+    """
+    group_values = {}
+    keys = ["_group_", *id_cols, "_feature_"]
+    with read_csv_chunks(uploaded_file, chunk_rows, REQUIRED_COLS) as reader:
+        for c, chunk in enumerate(reader):
+            chunk = add_metric_parts(chunk).dropna(subset=id_cols)
+            chunk["_group_"] = group_tokens(chunk, group_cols)
+            chunk["_feature_"] = chunk["Metrics"].astype(str)
+            firsts = chunk.drop_duplicates("_group_")[["_group_", *group_cols]]
+            for row in firsts.itertuples(index=False, name=None):
+                group_values.setdefault(row[0], row[1:])
+
+            partial = chunk.groupby(keys, sort=False)["Value"].agg(OOC_PARTIAL_AGGS[agg]).reset_index()
+            part_ids = pd.util.hash_pandas_object(partial[keys[:-1]], index=False).to_numpy() % n_partitions
+            for p, part in partial.groupby(part_ids, sort=False):
+                part.to_pickle(work_dir / f"partial_{p:04d}_{c:06d}.pkl")
+    return group_values
+
+
+def ooc_finalize_partition(paths: list[Path], id_cols: list[str], agg: str) -> pd.DataFrame:
+    """Combine one partition's partials into wide rows (_group_, id_cols, EXPECTED_METRICS)."""
+    partial = pd.concat([pd.read_pickle(path) for path in paths], ignore_index=True)
+    stats = OOC_PARTIAL_AGGS[agg]
+    combined = partial.groupby(["_group_", *id_cols, "_feature_"], sort=False)[stats].agg(
+        {stat: OOC_COMBINE[stat] for stat in stats}
     )
-    return keys
+    if agg == "mean":
+        value = combined["sum"] / combined["count"].where(combined["count"] > 0)
+    else:
+        value = combined[stats[0]]
 
+    wide = value.unstack("_feature_")
+    wide = wide.loc[wide.notna().any(axis=1)]  # rows with all features NaN are dropped, as in the pivot
+    wide = wide.reindex(columns=EXPECTED_METRICS).astype(float).fillna(0.0)
+    wide.columns.name = None
+    return wide.reset_index()
 
-def filter_by_group(df: pd.DataFrame, group_cols: list[str], key: tuple) -> pd.DataFrame:
-    if not group_cols:
-        return df
-    out = df
-    for col, val in zip(group_cols, key):
-        out = out[out[col].astype(str) == str(val)]
-    return out
+
+def merge_moments(acc: pd.DataFrame | None, wide: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fold one partition into per-group (n, mean, scatter matrix) with the pairwise update
+    (Chan et al.), which stays accurate where raw sums of squares would cancel.
+    """
+    n_f = len(EXPECTED_METRICS)
+    X = wide[EXPECTED_METRICS].to_numpy()
+    grouped = wide.groupby("_group_", sort=False)[EXPECTED_METRICS]
+    n_b = grouped.size()
+    mean_b = grouped.mean()
+    centered = X - mean_b.loc[wide["_group_"]].to_numpy()
+    scatter_b = pd.DataFrame(
+        np.einsum("ni,nj->nij", centered, centered).reshape(len(X), -1), index=wide["_group_"]
+    ).groupby(level=0, sort=False).sum()
+    part = pd.concat([n_b.rename("n"), mean_b, scatter_b.add_prefix("c")], axis=1)
+    if acc is None:
+        return part
+
+    index = acc.index.union(part.index)
+    a = acc.reindex(index, fill_value=0.0)
+    b = part.reindex(index, fill_value=0.0)
+    n_a, n_b = a["n"].to_numpy(), b["n"].to_numpy()
+    n = n_a + n_b
+    delta = b[EXPECTED_METRICS].to_numpy() - a[EXPECTED_METRICS].to_numpy()
+    mean = a[EXPECTED_METRICS].to_numpy() + delta * (n_b / n)[:, None]
+    scatter = (
+        a.iloc[:, 1 + n_f:].to_numpy() + b.iloc[:, 1 + n_f:].to_numpy()
+        + np.einsum("gi,gj->gij", delta, delta).reshape(len(index), -1) * (n_a * n_b / n)[:, None]
+    )
+    return pd.DataFrame(np.column_stack([n, mean, scatter]), index=index, columns=acc.columns)
+
+
+def pca_from_moments(moments: pd.DataFrame, n_components: int, standardize: bool):
+    """Per-group (mean, scale, components, explained variance ratio) from streaming moments."""
+    n_f = len(EXPECTED_METRICS)
+    n = moments["n"].to_numpy()
+    mean = moments[EXPECTED_METRICS].to_numpy()
+    scatter = moments.iloc[:, 1 + n_f:].to_numpy().reshape(-1, n_f, n_f)
+    scale = np.ones_like(mean)
+    if standardize:
+        # Same constant-feature rule as StandardScaler
+        var = np.diagonal(scatter, axis1=1, axis2=2) / n[:, None]
+        eps = np.finfo(np.float64).eps
+        constant = var <= n[:, None] * eps * var + (n[:, None] * mean * eps) ** 2
+        scale = np.where(constant, 1.0, np.sqrt(var))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = scatter / (n - 1)[:, None, None] / (scale[:, :, None] * scale[:, None, :])
+    eigenvals, components = eigh_components(np.nan_to_num(cov))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratios = eigenvals / eigenvals.sum(axis=1, keepdims=True)
+    return mean, scale, components[:, :, :n_components], ratios[:, :n_components]
+
+
+@st.cache_resource(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def ooc_color_categories(digest: str, color_by: str, chunk_rows: int, _uploaded_file) -> list[str]:
+    source = "Metrics" if color_by == "MetricBound" else color_by
+    categories = set()
+    with read_csv_chunks(_uploaded_file, chunk_rows, [source]) as reader:
+        for chunk in reader:
+            if color_by == "MetricBound":
+                chunk = add_metric_parts(chunk)
+            categories.update(chunk[color_by].astype(str).unique().tolist())
+    return sorted(categories)
+
+
+@st.cache_resource(max_entries=STAGE_CACHE_ENTRIES, show_spinner=False)
+def ooc_stage(
+    digest: str, id_cols: tuple, group_cols: tuple, agg: str, standardize: bool, n_components: int,
+    chunk_rows: int, _uploaded_file,
+) -> dict:
+    """
+    Out-of-core counterpart of pivot_stage + pca_stage. Returns keys, per-group results
+    ((sampled pca_df, explained variance ratio) or an exception), full row counts and, per group,
+    the CSV holding all of its scores.
+    """
+    id_cols, group_cols = list(id_cols), list(group_cols)
+    params = f"{digest}|{id_cols}|{group_cols}|{agg}|{standardize}|{n_components}|{chunk_rows}"
+    work_dir = OOC_DIR / hashlib.sha1(params.encode()).hexdigest()[:16]
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    n_partitions = max(OOC_MIN_PARTITIONS, -(-_uploaded_file.size // OOC_PARTITION_BYTES))
+
+    group_values = ooc_spill_partials(_uploaded_file, work_dir, id_cols, group_cols, agg, chunk_rows, n_partitions)
+
+    # Finalize partitions into wide rows and fold them into per-group moments
+    moments = None
+    wide_paths = []
+    for p in range(n_partitions):
+        paths = sorted(work_dir.glob(f"partial_{p:04d}_*.pkl"))
+        if not paths:
+            continue
+        wide = ooc_finalize_partition(paths, id_cols, agg)
+        for path in paths:
+            path.unlink()
+        if wide.empty:
+            continue
+        moments = merge_moments(moments, wide)
+        wide_paths.append(work_dir / f"wide_{p:04d}.pkl")
+        wide.to_pickle(wide_paths[-1])
+
+    if moments is None:
+        return {"keys": [], "results": [], "counts": [], "scores_paths": []}
+
+    # Chunks read the text columns as str; group columns that are all numbers (e.g. Bead) are parsed,
+    # so groups sort (and are labelled) as in the in-memory pivot: 1, 2, 10 rather than 1, 10, 2
+    group_table = pd.DataFrame(
+        [group_values[token] for token in moments.index], columns=group_cols, index=moments.index
+    )
+    for col in group_cols:
+        parsed = pd.to_numeric(group_table[col], errors="coerce")
+        if parsed.notna().sum() == group_table[col].notna().sum():
+            group_table[col] = parsed
+    if group_cols:
+        group_table = group_table.sort_values(group_cols, na_position="last", kind="stable")
+    tokens = group_table.index.tolist()
+    moments = moments.loc[tokens]
+    counts = moments["n"].to_numpy().astype(np.int64)
+    mean, scale, components, ratios = pca_from_moments(moments, n_components, standardize)
+
+    # Pass 2: project every partition, append scores to disk, keep a per-group sample for plotting
+    token_index = pd.Index(tokens)
+    sample_prob = np.minimum(1.0, OOC_PLOT_POINTS / np.maximum(counts, 1))
+    rng = np.random.default_rng(0)
+    scores_paths = [work_dir / f"scores_{j:05d}.csv" for j in range(len(tokens))]
+    samples = []
+    for i, path in enumerate(wide_paths):
+        wide = pd.read_pickle(path)
+        g = token_index.get_indexer(wide["_group_"])
+        X_used = (wide[EXPECTED_METRICS].to_numpy() - mean[g]) / scale[g]
+        Z = np.einsum("ni,nik->nk", X_used, components[g])
+        scores = wide.assign(
+            PC1=Z[:, 0],
+            PC2=Z[:, 1] if n_components >= 2 else 0.0,
+            PC3=Z[:, 2] if n_components >= 3 else 0.0,
+        )
+        full = pd.concat([group_table.iloc[g].reset_index(drop=True), scores.drop(columns="_group_").reset_index(drop=True)], axis=1)
+        for j, part in full.groupby(g, sort=False):
+            part.to_csv(scores_paths[j], mode="a", header=not scores_paths[j].exists(), index=False)
+        samples.append(scores.loc[rng.random(len(scores)) < sample_prob[g]])
+        path.unlink()
+
+    sample = pd.concat(samples, ignore_index=True)
+    sampled = {token: part.drop(columns="_group_") for token, part in sample.groupby("_group_", sort=False)}
+    results = []
+    for j, token in enumerate(tokens):
+        if counts[j] < max(2, n_components):
+            results.append(ValueError(f"Only {counts[j]} row(s) in this group; PCA needs at least {max(2, n_components)}."))
+        else:
+            sample_df = sampled.get(token, sample.iloc[:0].drop(columns="_group_"))
+            results.append((sample_df.reset_index(drop=True), ratios[j]))
+    keys = list(group_table.itertuples(index=False, name=None)) if group_cols else [tuple()] * len(tokens)
+    return {"keys": keys, "results": results, "counts": counts.tolist(), "scores_paths": scores_paths}
 
 
 # =========================
@@ -146,24 +643,43 @@ st.caption(
 with st.sidebar:
     st.header("1) Upload")
     uploaded = st.file_uploader("Upload CSV (or XLSX)", type=["csv", "xlsx", "xls"])
+    out_of_core = st.checkbox(
+        "Out-of-core mode (CSV larger than memory)", value=False,
+        help="Reads the CSV in chunks, spills partial results to disk and plots a sample of each group.",
+    )
+    if out_of_core:
+        chunk_rows = st.number_input(
+            "Rows per chunk", min_value=10_000, max_value=10_000_000, value=OOC_DEFAULT_CHUNK_ROWS, step=50_000
+        )
 
 if not uploaded:
     st.info("Upload a file to begin. Expected columns: " + ", ".join(REQUIRED_COLS))
     st.stop()
 
 # Load + validate early (so we can show color mapping inputs before Start Plotting)
-try:
-    df_long = read_long_table(uploaded)
-except Exception as e:
-    st.error(str(e))
-    st.stop()
+digest = file_digest(uploaded, uploaded.file_id)
+df_long = None
+if out_of_core:
+    if not uploaded.name.lower().endswith(".csv"):
+        st.error("Out-of-core mode needs a .csv upload.")
+        st.stop()
+    uploaded.seek(0)
+    columns = pd.read_csv(uploaded, nrows=0).columns
+else:
+    try:
+        df_long = load_stage(digest, uploaded)
+    except Exception as e:
+        st.error(str(e))
+        st.stop()
+    columns = df_long.columns
 
-missing = [c for c in REQUIRED_COLS if c not in df_long.columns]
+missing = [c for c in REQUIRED_COLS if c not in columns]
 if missing:
     st.error(f"Missing required columns: {missing}")
     st.stop()
 
-df_long = add_metric_parts(df_long)
+if df_long is not None:
+    df_long = metric_stage(digest, df_long)
 
 # -------------------------
 # Sidebar Controls
@@ -188,6 +704,10 @@ with st.sidebar:
 
     st.header("6) Figure height")
     fig_height = st.slider("Height (px)", 400, 1600, 800, 50)
+    plot_points = st.number_input(
+        "Max plotted points per figure", min_value=1000, max_value=2_000_000, value=DEFAULT_PLOT_POINTS, step=10_000,
+        help="Larger groups are sampled per color category for plotting; the CSV download keeps every point.",
+    )
 
 # Build group columns list (for multi-figure)
 group_cols = []
@@ -198,11 +718,15 @@ if per_bead_fig:
 if per_bound_fig:
     group_cols.append("MetricBound")
 
+if out_of_core and agg not in OOC_PARTIAL_AGGS:
+    st.error(f"'{agg}' aggregation needs all values at once and is not available in out-of-core mode.")
+    st.stop()
+
 # Color category list (global, so user can set HEX before plotting)
-if color_by not in df_long.columns:
-    color_categories = []
+if out_of_core:
+    color_categories = ooc_color_categories(digest, color_by, chunk_rows, uploaded)
 else:
-    color_categories = sorted(df_long[color_by].astype(str).unique().tolist())
+    color_categories = color_categories_stage(digest, color_by, df_long)
 
 with st.sidebar:
     st.subheader("HEX color map (optional)")
@@ -223,7 +747,10 @@ with st.sidebar:
     st.divider()
     start = st.button("▶ Start Plotting", type="primary", use_container_width=True)
 
-if not start:
+# Plotting stays on for this file across reruns, so changing an option just redraws
+if start:
+    st.session_state["plotting_started_for"] = digest
+if st.session_state.get("plotting_started_for") != digest:
     st.warning("Set options in the sidebar, then click **Start Plotting**.")
     st.stop()
 
@@ -238,7 +765,32 @@ for (cb, v), hexv in st.session_state.get("hex_map_global", {}).items():
 # -------------------------
 base_id_cols = ["Class", "Sub-class", "Stat"]  # inside each figure, points are defined by this base identity
 
-keys = make_group_keys(df_long, group_cols)
+# Use consistent feature order
+feat_cols = EXPECTED_METRICS
+
+# Now PCA dimension logic
+n_features = len(feat_cols)
+n_components = min(requested_components, n_features)
+
+if out_of_core:
+    with st.spinner("Streaming the CSV in chunks (pivot, covariance, scores)..."):
+        ooc = ooc_stage(
+            digest, tuple(base_id_cols), tuple(group_cols), agg, standardize, max(1, n_components),
+            chunk_rows, uploaded,
+        )
+    keys, group_counts = ooc["keys"], ooc["counts"]
+    pca_results = dict(enumerate(ooc["results"]))
+else:
+    # One shared pivot for all groups (instead of filtering + pivoting the long table per group)
+    try:
+        keys, wides = pivot_stage(digest, tuple(base_id_cols), tuple(group_cols), agg, df_long)
+    except Exception as e:
+        st.error(f"Pivot failed: {e}")
+        st.stop()
+
+    # Groups already fitted for these options; the rest are fitted below while figures render
+    pca_results = pca_stage(digest, tuple(base_id_cols), tuple(group_cols), agg, standardize, max(1, n_components))
+    group_counts = None
 
 st.subheader("Plots")
 
@@ -247,60 +799,26 @@ if group_cols:
     st.caption(f"Generating **{len(keys)}** figure(s) by: **{', '.join(group_cols)}**")
 else:
     st.caption("Generating **1** figure (no grouping).")
+if out_of_core and keys:
+    st.caption(
+        f"Out-of-core: plots show up to {OOC_PLOT_POINTS:,} sampled points per figure; "
+        "each group's CSV download holds all of its scores"
+    )
 
 # Render figures
-for idx, key in enumerate(keys, start=1):
-    df_g = filter_by_group(df_long, group_cols, key)
-
-    # If grouping by MetricBound, within a group only U or only L => fewer metric columns will exist.
-    # We still pivot by Metrics. PCA dimensionality will adapt automatically.
+# A figure, its table preview and its CSV are only built once its expander is open, and kept
+# (keyed by every option they depend on) so reopening a group or paging back is instant.
+show_3d = (requested_components == 3 and n_components >= 3)  # 2D plot when only 2 features are left
+color_items = tuple(sorted(color_map.items()))
+view = (
+    digest, out_of_core, chunk_rows if out_of_core else None, tuple(base_id_cols), tuple(group_cols), agg,
+    standardize, n_components, requested_components, color_by, color_items, fig_height, plot_points,
+)
 
-    # Pivot
-    try:
-        wide, feat_cols = pivot_wide(df_g, id_cols=base_id_cols, agg=agg)
-    except Exception as e:
-        st.error(f"[Group {idx}] Pivot failed: {e}")
-        continue
-
-    # if len(feat_cols) == 0:
-    #     st.warning(f"[Group {idx}] No feature columns after pivot. Skipping.")
-    #     continue
-
-    # # Decide feasible PCA components
-    # n_features = len(feat_cols)
-    # n_components = min(requested_components, n_features)
-
-    # -------------------------------------------------
-    # FORCE ALL 4 METRICS TO EXIST (prevents zero rows from disappearing)
-    # -------------------------------------------------
-    EXPECTED_METRICS = ["SUMP_L", "SUMP_U", "MAXP_L", "MAXP_U"]
-    
-    for m in EXPECTED_METRICS:
-        if m not in wide.columns:
-            wide[m] = 0.0  # create missing metric column as 0
-    
-    # Use consistent feature order
-    feat_cols = EXPECTED_METRICS
-    
-    # Fill any remaining NaN with 0
-    wide[feat_cols] = wide[feat_cols].astype(float).fillna(0.0)
-    
-    # Now PCA dimension logic
-    n_features = len(feat_cols)
-    n_components = min(requested_components, n_features)
 
-    # Run PCA
-    try:
-        pca_df, var = fit_pca(
-            wide=wide,
-            id_cols=base_id_cols,
-            feat_cols=feat_cols,
-            n_components=max(1, n_components),
-            standardize=standardize,
-        )
-    except Exception as e:
-        st.error(f"[Group {idx}] PCA failed: {e}")
-        continue
+def group_frame(key: tuple, pca_df: pd.DataFrame) -> tuple[pd.DataFrame, str]:
+    """Scores with the group values attached, and the column to color by."""
+    pca_df = pca_df.copy()  # cached result; group columns are attached below
 
     # Choose color column (must exist in this pca_df; it will, because base_id_cols include Stat/Class, but not always Channel/Bead/Bound)
     # If user chooses to color by a grouped dimension, it is constant within the figure and still exists only if we add it.
@@ -312,67 +830,128 @@ for idx, key in enumerate(keys, start=1):
     if color_col not in pca_df.columns:
         pca_df["__all__"] = "ALL"
         color_col = "__all__"
+    return pca_df, color_col
+
+
+@st.cache_resource(max_entries=ARTEFACT_CACHE_ENTRIES, show_spinner=False)
+def group_artefacts(view: tuple, idx: int, title: str, _key: tuple, _pca_df: pd.DataFrame) -> dict:
+    """Figure, plotted point count and table preview of one group (view covers the options used)."""
+    pca_df, color_col = group_frame(_key, _pca_df)
 
     # Hover
     hover_cols = [c for c in ["Class", "Sub-class", "Stat", "Channel", "Bead", "MetricBound"] if c in pca_df.columns]
 
+    # Large groups are plotted from a per-category sample; the table and download keep every row
+    plot_df = decimate_by_category(pca_df, color_col, plot_points)
+
+    if show_3d:
+        fig = px.scatter_3d(
+            plot_df,
+            x="PC1", y="PC2", z="PC3",
+            color=color_col,
+            color_discrete_map=color_map if color_map else None,
+            hover_data=hover_cols,
+            title=title,
+        )
+        fig.update_traces(marker=dict(size=5))
+    else:
+        fig = px.scatter(
+            plot_df,
+            x="PC1", y="PC2",
+            color=color_col,
+            color_discrete_map=color_map if color_map else None,
+            hover_data=hover_cols,
+            title=title,
+            render_mode="webgl" if len(plot_df) > WEBGL_MIN_POINTS else "svg",
+        )
+        fig.update_traces(marker=dict(size=8))
+    fig.update_layout(height=fig_height)
+    return {"fig": fig, "plotted": len(plot_df), "head": pca_df.head(50)}
+
+
+@st.cache_resource(max_entries=ARTEFACT_CACHE_ENTRIES, show_spinner=False)
+def group_csv(view: tuple, idx: int, _key: tuple, _pca_df: pd.DataFrame) -> bytes:
+    return group_frame(_key, _pca_df)[0].to_csv(index=False).encode("utf-8")
+
+
+def render_group(idx: int, key: tuple, result) -> None:
+    if isinstance(result, Exception):
+        st.error(f"[Group {idx}] PCA failed: {result}")
+        return
+    pca_df, var = result
+
     # Title per figure
     if group_cols:
         group_label = ", ".join([f"{c}={safe_str(v)}" for c, v in zip(group_cols, key)])
     else:
         group_label = "ALL"
 
-    # If requested 3D but only 2 features (e.g., Upper-only), we show 2D plot for that figure.
-    show_3d = (requested_components == 3 and n_components >= 3)
-
     title = (
         f"[{idx}/{len(keys)}] {group_label} | "
         f"PCA_dim={'3D' if show_3d else '2D'} | features={feat_cols} | "
         f"agg={agg} | standardize={standardize} | explained_var={np.round(var, 3)}"
     )
 
-    with st.expander(title, expanded=(idx == 1)):
-        # Plot
-        if show_3d:
-            fig = px.scatter_3d(
-                pca_df,
-                x="PC1", y="PC2", z="PC3",
-                color=color_col,
-                color_discrete_map=color_map if color_map else None,
-                hover_data=hover_cols,
-                title=title,
-            )
-            fig.update_traces(marker=dict(size=5))
-            fig.update_layout(height=fig_height)
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            fig = px.scatter(
-                pca_df,
-                x="PC1", y="PC2",
-                color=color_col,
-                color_discrete_map=color_map if color_map else None,
-                hover_data=hover_cols,
-                title=title,
-            )
-            fig.update_traces(marker=dict(size=8))
-            fig.update_layout(height=fig_height)
-            st.plotly_chart(fig, use_container_width=True)
+    expander = st.expander(title, expanded=(idx == 1), key=f"group_open__{idx}", on_change="rerun")
+    if not expander.open:
+        return
+    artefacts = group_artefacts(view, idx, title, key, pca_df)
+    total_points = group_counts[idx - 1] if group_counts is not None else len(pca_df)
+
+    with expander:
+        st.plotly_chart(artefacts["fig"], use_container_width=True)
 
         # Summary + download for this group
         c1, c2 = st.columns([1, 1])
         with c1:
-            st.write(f"- Points: **{len(pca_df)}**")
+            if artefacts["plotted"] < total_points:
+                st.write(f"- Points: **{artefacts['plotted']}** plotted of **{total_points}**")
+            else:
+                st.write(f"- Points: **{total_points}**")
             st.write(f"- Features: **{len(feat_cols)}**")
             st.write(f"- PCA components used: **{n_components}**")
             st.write(f"- Explained variance: **{np.round(var, 4)}**")
         with c2:
-            csv_bytes = pca_df.to_csv(index=False).encode("utf-8")
             st.download_button(
                 f"Download this group CSV ({idx})",
-                data=csv_bytes,
+                # Built on click; out-of-core groups are served from their full scores file on disk
+                data=ooc["scores_paths"][idx - 1].read_bytes if out_of_core else lambda: group_csv(view, idx, key, pca_df),
                 file_name=f"pca_group_{idx}.csv",
                 mime="text/csv",
                 use_container_width=True,
             )
 
-        st.dataframe(pca_df.head(50), use_container_width=True)
+        st.dataframe(artefacts["head"], use_container_width=True)
+
+
+# Paginate the group list; PCA and rendering cover only the groups on the shown page
+n_pages = max(1, -(-len(keys) // GROUPS_PER_PAGE))
+page = 1
+if n_pages > 1:
+    page = st.selectbox(
+        "Page", range(1, n_pages + 1),
+        format_func=lambda p: f"Figures {(p - 1) * GROUPS_PER_PAGE + 1}–{min(p * GROUPS_PER_PAGE, len(keys))}",
+    )
+page_groups = range((page - 1) * GROUPS_PER_PAGE, min(page * GROUPS_PER_PAGE, len(keys)))
+
+# Figures keep their order: each group has a slot that is filled as soon as its PCA is ready
+progress_slot = st.empty()
+slots = {i: st.container() for i in page_groups}
+ready = dict(pca_results)
+for i in page_groups:
+    if i in ready:
+        with slots[i]:
+            render_group(i + 1, keys[i], ready[i])
+
+todo = [i for i in page_groups if i not in ready]
+if todo:
+    progress = progress_slot.progress(0.0, text=f"PCA: 0/{len(todo)} group(s)")
+    done = 0
+    for chunk_results in run_pca_chunks(wides, todo, base_id_cols, max(1, n_components), standardize):
+        pca_results.update(chunk_results)
+        for i, result in sorted(chunk_results.items()):
+            with slots[i]:
+                render_group(i + 1, keys[i], result)
+        done += len(chunk_results)
+        progress.progress(done / len(todo), text=f"PCA: {done}/{len(todo)} group(s)")
+    progress_slot.empty()
@@ -0,0 +1,167 @@
+"""Headless export of an NVH archive to one self-contained HTML report.
+
+Renders every member's bead + status figure with the 250808_NVH_PowerSourceCase_v05.py pipeline,
+downsampled to a point budget, builds the figures in parallel worker processes and writes a single
+HTML file with plotly.js embedded once.
+
+    python 261019_NVH_HTML_Report.py archive.zip --status status.csv --out report.html
+    python 261019_NVH_HTML_Report.py archive.zip --status status.csv --series Power-Out Gas-Flow --offset auto
+"""
+import argparse
+import html
+import importlib.util
+import io
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import pandas as pd
+from plotly.offline import get_plotlyjs
+
+VIEWER_SCRIPT = Path(__file__).with_name("250808_NVH_PowerSourceCase_v05.py")
+DEFAULT_POINT_BUDGET = 1000
+
+_viewer = None
+_worker_state = {}
+
+
+def load_viewer():
+    # Executing the viewer without a Streamlit session runs only its definitions (no upload -> no main flow)
+    logging.disable(logging.WARNING)
+    spec = importlib.util.spec_from_file_location("nvh_viewer", VIEWER_SCRIPT)
+    viewer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(viewer)
+    return viewer
+
+
+# --- Worker processes ---
+def init_worker(point_budget, status_series):
+    global _viewer
+    _viewer = load_viewer()
+    # The viewer picks the pyramid level against this budget (points per bead trace)
+    _viewer.TRACE_POINT_BUDGET = point_budget
+    _worker_state["status_series"] = status_series
+
+
+def render_member(member, handle, status_key, status_plot_type):
+    # Returns (member, figure <div>, resolution caption); status_key as in build_file_figure
+    df_plot, pyramid = _viewer.load_member(handle["path"])
+    window = (handle["adjusted_range"][0].to_pydatetime(), handle["adjusted_range"][1].to_pydatetime())
+    fig, resolution = _viewer.build_file_figure.__wrapped__(
+        "report", handle["name"], window, None, status_key, status_plot_type, None,
+        df_plot, pyramid, _worker_state["status_series"], None,
+    )
+    div = fig.to_html(full_html=False, include_plotlyjs=False, div_id=f"member-{member}")
+    return member, div, resolution
+
+
+# --- Report ---
+def render_report(title, summary_lines, sections):
+    # sections: list of (name, caption, figure div) in archive order
+    toc = "\n".join(
+        f'<li><a href="#section-{i}">{html.escape(name)}</a></li>' for i, (name, _, _) in enumerate(sections)
+    )
+    body = "\n".join(
+        f'<section id="section-{i}"><h2>{html.escape(name)}</h2>'
+        f'<p class="caption">{html.escape(caption)}</p>{div}</section>'
+        for i, (name, caption, div) in enumerate(sections)
+    )
+    summary = "".join(f"<p>{html.escape(line)}</p>" for line in summary_lines)
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<script type="text/javascript">{get_plotlyjs()}</script>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+.caption {{ color: #666; font-size: 0.9em; }}
+section {{ margin-bottom: 3em; }}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+{summary}
+<ul>{toc}</ul>
+{body}
+</body>
+</html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("zip", type=Path, help="ZIP of bead signal CSVs")
+    parser.add_argument("--status", type=Path, help="Machine status CSV (Timestamp, Stat1, Stat2, Value)")
+    parser.add_argument("--series", nargs="*", help="Status series to overlay (Stat1-Stat2); default: first")
+    parser.add_argument("--offset", default=None,
+                        help="Status clock offset in seconds, or 'auto' for the FFT estimate (default: 388)")
+    parser.add_argument("--plot-type", choices=["Line", "Scatter", "Step"], default="Line")
+    parser.add_argument("--budget", type=int, default=DEFAULT_POINT_BUDGET, help="Max points per trace")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Reuse members parsed by earlier runs (store under ./.nvh_cache)")
+    parser.add_argument("--out", type=Path, default=Path("nvh_report.html"))
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    viewer = load_viewer()
+    handles, time_range, _, _ = viewer.process_zip.__wrapped__(str(args.zip), incremental=args.incremental)
+    if not handles:
+        raise SystemExit("No valid CSV data found in ZIP.")
+    summary = [
+        f"{len(handles)} file(s), {sum(handle['n_rows'] for handle in handles):,} bead rows, "
+        f"captures from {time_range[0]} to {time_range[1]}"
+    ]
+
+    status_key = None
+    status_series = {}
+    if args.status:
+        status_bytes = io.BytesIO(args.status.read_bytes())
+        digest = viewer.status_file_digest.__wrapped__(status_bytes, str(args.status.resolve()))
+        if not viewer.has_status_columns(status_bytes):
+            raise SystemExit("Machine status CSV needs Timestamp, Stat1, Stat2 and Value columns.")
+        status_wide = viewer.load_status_wide.__wrapped__(status_bytes, digest)
+        labels = args.series or status_wide.columns[:1].tolist()
+        missing = sorted(set(labels) - set(status_wide.columns))
+        if missing:
+            raise SystemExit(f"Unknown status series: {', '.join(missing)}")
+
+        time_offset = viewer.STATUS_TIME_OFFSET
+        if args.offset == "auto":
+            estimate = viewer.estimate_status_offset.__wrapped__(
+                handles, str(args.zip), status_wide[labels[0]].dropna(), digest, labels[0], 15
+            )
+            if estimate is not None and estimate[1] >= viewer.OFFSET_MIN_CONFIDENCE:
+                time_offset = estimate[0]
+            summary.append(f"Estimated status clock offset from {labels[0]}: "
+                           + ("n/a" if estimate is None else f"{estimate[0]} (confidence {estimate[1]:.2f})"))
+        elif args.offset is not None:
+            time_offset = pd.Timedelta(seconds=float(args.offset))
+        summary.append(f"Status series {', '.join(labels)}, clock offset {time_offset}")
+
+        # Only the overlaid series, already downsampled, are shipped to the workers
+        status_series = {label: viewer.downsample_series(status_wide[label].dropna(), args.budget) for label in labels}
+        status_key = (digest, tuple(labels), time_offset)
+
+    sections = [None] * len(handles)
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=init_worker, initargs=(args.budget, status_series)
+    ) as pool:
+        futures = [
+            pool.submit(render_member, member, handle, status_key, args.plot_type)
+            for member, handle in enumerate(handles)
+        ]
+        for future in as_completed(futures):
+            member, div, resolution = future.result()
+            sections[member] = (handles[member]["name"], resolution, div)
+
+    report = render_report(f"NVH report – {args.zip.name}", summary, sections)
+    args.out.write_text(report, encoding="utf-8")
+    print(f"Wrote {args.out} ({len(report) / 2**20:.1f} MB, {len(handles)} figures) "
+          f"in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""Synthetic NVH archive generator and benchmark for the v05 viewer pipeline.
+
+Writes a ZIP of bead-signal CSVs named like production captures
+(HHMMSS_<BM with YYMMDDY####>_..._F##_<stat>.csv in column 0, one signal column per bead)
+plus a matching machine status CSV, then times and memory-profiles each stage of
+250808_NVH_PowerSourceCase_v05.py: unzip, parse, expand, gap-compress, process_zip,
+status pivot/alignment and figure build.
+
+    python 261019_NVH_SyntheticArchive_Benchmark.py --days 5 --captures-per-day 2000 --beads 30 --files 4
+    python 261019_NVH_SyntheticArchive_Benchmark.py --scale 10 --keep ./bench_out
+"""
+import argparse
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+VIEWER_SCRIPT = Path(__file__).with_name("250808_NVH_PowerSourceCase_v05.py")
+START_DATE = pd.Timestamp("2025-08-07")
+SHIFT_START = pd.Timedelta(hours=8)
+SHIFT_LENGTH = pd.Timedelta(hours=14)
+STATUS_PERIOD = pd.Timedelta(seconds=20)
+STATUS_CLOCK_OFFSET = pd.Timedelta("6m28s")  # PLC clock runs ahead of the capture clock
+STATUS_SERIES = [("Power", "Out"), ("Power", "Set"), ("Gas", "Flow")]
+STAT_SUFFIXES = ["ok", "ok", "ok", "ok", "ng"]
+SETPOINT_PERIOD_S = 90
+STATUS_COUPLING = 2.0  # bead signal units per status unit
+SETPOINT_LEVELS = np.random.default_rng(12345).random(366 * 86400 // SETPOINT_PERIOD_S)
+
+
+# --- Synthetic archive ---
+def status_signal(times):
+    # Slow drift plus random setpoint steps every 90 s, evaluated on the capture clock;
+    # deterministic in absolute time so members and the status file agree
+    seconds = np.asarray((times - START_DATE) / pd.Timedelta(seconds=1))
+    cells = (seconds // SETPOINT_PERIOD_S).astype(np.int64) % len(SETPOINT_LEVELS)
+    return 5 + np.sin(seconds / 1800) + 2 * SETPOINT_LEVELS[cells]
+
+
+def capture_times(rng, days, captures_per_day):
+    # Captures 5-60 s apart during one shift per day, with the overnight gap the viewer compresses;
+    # spacing shrinks at large scales so a day's captures still fit in the shift
+    high = int(np.clip(2 * SHIFT_LENGTH / pd.Timedelta(seconds=1) / max(captures_per_day, 1), 2, 60))
+    per_day = []
+    for day in range(days):
+        spacing = rng.integers(max(high // 12, 1), high, captures_per_day).astype("timedelta64[s]")
+        per_day.append(np.datetime64(START_DATE + pd.Timedelta(days=day) + SHIFT_START) + np.cumsum(spacing))
+    return pd.DatetimeIndex(np.concatenate(per_day))
+
+
+def write_member_csv(rng, times, file_idx, beads):
+    # Column 0 carries the capture name, the remaining columns one signal value per bead
+    f_codes = np.char.add("F", np.char.zfill((np.arange(len(times)) % 3 + 1).astype(str), 2))
+    suffixes = np.array(STAT_SUFFIXES)[np.arange(len(times)) % len(STAT_SUFFIXES)]
+    names = (
+        times.strftime("%H%M%S") + "_BM" + times.strftime("%y%m%d") + f"Y{file_idx:04d}_L1_"
+        + f_codes + "_" + suffixes + ".csv"
+    )
+    signals = rng.normal(100, 2, (len(times), beads)) + STATUS_COUPLING * status_signal(times)[:, None]
+    frame = pd.DataFrame(signals.round(3))
+    frame.insert(0, "name", names)
+    return frame.to_csv(header=False, index=False)
+
+
+def write_archive(out_dir, days, captures_per_day, beads, files, seed):
+    rng = np.random.default_rng(seed)
+    zip_path = out_dir / "synthetic_nvh.zip"
+    all_times = []
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+        for file_idx in range(files):
+            times = capture_times(rng, days, captures_per_day)
+            all_times.append(times)
+            z.writestr(f"bead_signals_{file_idx:02d}.csv", write_member_csv(rng, times, file_idx, beads))
+
+    # Status samples cover every shift, on the PLC clock
+    first, last = min(t[0] for t in all_times), max(t[-1] for t in all_times)
+    grid = pd.date_range(first.floor("min"), last.ceil("min"), freq=STATUS_PERIOD)
+    grid = grid[np.isin(grid.normalize(), np.unique(np.concatenate([t.normalize() for t in all_times])))]
+    values = {"Power-Out": status_signal(grid), "Power-Set": np.round(status_signal(grid)),
+              "Gas-Flow": rng.normal(12, 0.5, len(grid))}
+    status = pd.concat([
+        pd.DataFrame({
+            "Timestamp": (grid + STATUS_CLOCK_OFFSET).strftime("%Y-%m-%d %H:%M:%S"),
+            "Stat1": stat1, "Stat2": stat2, "Value": values[f"{stat1}-{stat2}"],
+        })
+        for stat1, stat2 in STATUS_SERIES
+    ]).sort_values("Timestamp", kind="stable")
+    status_path = out_dir / "synthetic_status.csv"
+    status.to_csv(status_path, index=False)
+    return zip_path, status_path
+
+
+# --- Benchmark harness ---
+def load_viewer():
+    # Executing the viewer without a Streamlit session runs only its definitions (no upload -> no main flow)
+    logging.disable(logging.WARNING)
+    spec = importlib.util.spec_from_file_location("nvh_viewer", VIEWER_SCRIPT)
+    viewer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(viewer)
+    return viewer
+
+
+def measure(results, stage, fn, detail=""):
+    tracemalloc.start()
+    start = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results.append({"stage": stage, "seconds": round(seconds, 3), "peak_mb": round(peak / 2**20, 1),
+                    "detail": detail(value) if callable(detail) else detail})
+    return value
+
+
+def run_benchmark(viewer, zip_path, status_path, figure_files):
+    results = []
+
+    def unzip():
+        with zipfile.ZipFile(zip_path) as z:
+            return {info.filename: z.read(info) for info in z.infolist() if info.filename.endswith(".csv")}
+
+    raw = measure(results, "unzip", unzip, lambda r: f"{len(r)} members, {sum(map(len, r.values())) / 2**20:.1f} MB")
+
+    def parse():
+        parsed = {}
+        for name, data in raw.items():
+            df = pd.read_csv(io.BytesIO(data), header=None)
+            viewer.parse_capture_names(df[0].astype(str))
+            parsed[name] = df
+        return parsed
+
+    parsed = measure(results, "parse (read_csv + capture names)", parse,
+                     lambda r: f"{sum(len(df) for df in r.values()):,} captures")
+    del raw
+
+    expanded = measure(
+        results, "expand (long compact frame)",
+        lambda: {name: viewer.expand_capture_rows(df, name) for name, df in parsed.items()},
+        lambda r: f"{sum(len(df) for df in r.values()):,} bead rows",
+    )
+    del parsed
+
+    def gap_compress():
+        for df in expanded.values():
+            times = df["original_time"].to_numpy()
+            df["adjusted_time"] = viewer.compress_date_gaps(times, times.astype("datetime64[D]"))
+
+    measure(results, "gap-compress", gap_compress)
+    del expanded
+
+    handles, _, _, _ = measure(
+        results, "process_zip (stream + spill + pyramid)",
+        lambda: viewer.process_zip.__wrapped__(str(zip_path), incremental=False),
+        lambda r: f"{len(r[0])} handles",
+    )
+
+    status_bytes = io.BytesIO(status_path.read_bytes())
+    digest = viewer.status_file_digest.__wrapped__(status_bytes, "benchmark")
+
+    status_wide = measure(results, "status wide table",
+                          lambda: viewer.load_status_wide.__wrapped__(status_bytes, digest),
+                          lambda r: f"{len(r):,} timestamps x {r.shape[1]} series")
+
+    def align():
+        times, _, _ = viewer.load_capture_matrix(handles)
+        return viewer.align_status_to_captures(times, status_wide, STATUS_CLOCK_OFFSET)
+
+    measure(results, "status alignment (captures x series)", align,
+            lambda r: f"{np.isfinite(r).mean():.0%} aligned")
+
+    estimate = measure(
+        results, "clock offset estimate (FFT)",
+        lambda: viewer.estimate_status_offset.__wrapped__(
+            handles, "benchmark", status_wide["Power-Out"].dropna(), digest, "Power-Out", 15),
+        lambda r: "no estimate" if r is None else f"{r[0]} (confidence {r[1]:.2f})",
+    )
+
+    def figures():
+        payload = 0
+        for handle in handles[:figure_files]:
+            df_plot, pyramid = viewer.load_member(handle["path"])
+            window = (handle["adjusted_range"][0].to_pydatetime(), handle["adjusted_range"][1].to_pydatetime())
+            status_key = (digest, tuple(status_wide.columns), STATUS_CLOCK_OFFSET)
+            fig, _ = viewer.build_file_figure.__wrapped__(
+                "benchmark", handle["name"], window, None, status_key, "Line", None,
+                df_plot, pyramid, status_wide, None,
+            )
+            payload += len(fig.to_json())
+        return payload
+
+    measure(results, "figure build + JSON", figures,
+            lambda r: f"{min(figure_files, len(handles))} figures, {r / 2**20:.1f} MB JSON")
+    return pd.DataFrame(results), estimate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=3)
+    parser.add_argument("--captures-per-day", type=int, default=500)
+    parser.add_argument("--beads", type=int, default=30)
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--scale", type=int, default=1, help="Multiply captures per day (e.g. 10 or 100)")
+    parser.add_argument("--figure-files", type=int, default=2, help="Members to build figures for")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", type=Path, help="Write the archive here and keep it (default: temp dir)")
+    parser.add_argument("--csv", type=Path, help="Also save the stage timings as CSV")
+    parser.add_argument("--generate-only", action="store_true")
+    args = parser.parse_args()
+    csv_path = args.csv.resolve() if args.csv else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = (args.keep or Path(tmp)).resolve()
+        out_dir.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        zip_path, status_path = write_archive(
+            out_dir, args.days, args.captures_per_day * args.scale, args.beads, args.files, args.seed
+        )
+        print(f"Generated {zip_path} ({zip_path.stat().st_size / 2**20:.1f} MB) and {status_path} "
+              f"in {time.perf_counter() - start:.1f} s")
+        if args.generate_only:
+            return
+
+        # The viewer keeps its spill/status caches under ./.nvh_cache; isolate them per run
+        os.chdir(tmp)
+        viewer = load_viewer()
+        results, estimate = run_benchmark(viewer, zip_path, status_path, args.figure_files)
+
+    print(results.to_string(index=False))
+    if estimate is not None:
+        print(f"Planted clock offset {STATUS_CLOCK_OFFSET}, estimated {estimate[0]}")
+    if csv_path:
+        results.to_csv(csv_path, index=False)
+
+
+if __name__ == "__main__":
+    main()